@@ -0,0 +1,54 @@
+"""Compares the fast article extraction with the ItemLoader based one on saved article pages
+
+Run from the project root: python -m benchmarks.bench_article_parser [--iterations N] [fixture.html ...]
+"""
+import argparse
+import json
+import os
+import timeit
+from scrapy.http import HtmlResponse
+from grid_blog_crawl.extractors import extract_article
+from grid_blog_crawl.spiders.article_spider import ArticleSpider
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_response(path, url='https://blog.griddynamics.com/fixture-article/'):
+    """:returns HtmlResponse with the body of the saved page"""
+
+    with open(path, 'rb') as page:
+        return HtmlResponse(url=url, body=page.read(), encoding='utf-8')
+
+
+def _fresh(response):
+    # parsed documents are cached on the response, every run has to parse the page again
+    return response.replace(body=response.body)
+
+
+def bench(path, iterations):
+    """:returns timings of both extraction paths for the saved page, the outputs have to be equal"""
+
+    response = load_response(path)
+    loader_items = ArticleSpider._load_article_items(_fresh(response))
+    fast_items = extract_article(_fresh(response))
+    if [dict(item) for item in loader_items] != [dict(item) for item in fast_items]:
+        raise AssertionError('Extraction paths differ for {}: {} != {}'.format(path, loader_items, fast_items))
+
+    loader = min(timeit.repeat(lambda: ArticleSpider._load_article_items(_fresh(response)),
+                               number=iterations, repeat=3)) / iterations
+    fast = min(timeit.repeat(lambda: extract_article(_fresh(response)), number=iterations, repeat=3)) / iterations
+    return {'fixture': os.path.basename(path), 'iterations': iterations,
+            'item_loader_ms': round(loader * 1000, 4), 'fast_path_ms': round(fast * 1000, 4),
+            'speedup': round(loader / fast, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('fixtures', nargs='*', default=[os.path.join(FIXTURES, 'article.html')])
+    args = parser.parse_args()
+    print(json.dumps([bench(path, args.iterations) for path in args.fixtures], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compares the batched card extraction with the per-card selectors on synthetic multi record pages
+
+Run from the project root: python -m benchmarks.bench_card_parser [--iterations N] [--page-size N ...]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+from scrapy.http import HtmlResponse
+from grid_blog_crawl.items import extract_date
+from grid_blog_crawl.spiders.article_spider import ArticleSpider
+from .blog_server import SyntheticBlog
+
+
+def _fresh(response):
+    # parsed documents are cached on the response, every run has to parse the page again
+    return response.replace(body=response.body)
+
+
+def _requests(response, watermark, fast_parser):
+    spider = ArticleSpider()
+    spider.root_url = 'https://blog.griddynamics.com'
+    spider.fast_parser = fast_parser
+    cards_seen = []
+    requests = spider._gen_requests(_fresh(response), watermark, cards_seen)
+    return [request.url for request in requests], cards_seen
+
+
+def bench(page_size, iterations):
+    """:returns timings of both card extraction paths and both date parsers for a page of page_size cards"""
+
+    blog = SyntheticBlog(articles=page_size, sections=1, page_size=page_size)
+    response = HtmlResponse('https://blog.griddynamics.com/section-0/', body=blog.section_page(0).encode(),
+                            encoding='utf-8')
+    # the watermark in the middle of the page, half of the cards are new
+    watermark = (blog.pub_date(page_size // 2), frozenset())
+    if _requests(response, watermark, False) != _requests(response, watermark, True):
+        raise AssertionError('Card extraction paths differ for a page of {} cards'.format(page_size))
+
+    per_card = min(timeit.repeat(lambda: _requests(response, watermark, False),
+                                 number=iterations, repeat=3)) / iterations
+    batched = min(timeit.repeat(lambda: _requests(response, watermark, True), number=iterations, repeat=3)) / iterations
+    dates = [blog._date_text(blog.pub_date(article)) for article in range(page_size)]
+    strptime = min(timeit.repeat(lambda: [datetime.strptime(text.strip(), '%b %d, %Y •').date() for text in dates],
+                                 number=iterations, repeat=3)) / iterations
+    month_table = min(timeit.repeat(lambda: [extract_date(text) for text in dates],
+                                    number=iterations, repeat=3)) / iterations
+    return {'cards': page_size + 1, 'iterations': iterations,
+            'per_card_ms': round(per_card * 1000, 4), 'batched_ms': round(batched * 1000, 4),
+            'speedup': round(per_card / batched, 2),
+            'strptime_ms': round(strptime * 1000, 4), 'month_table_ms': round(month_table * 1000, 4),
+            'date_speedup': round(strptime / month_table, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--page-size', type=int, nargs='*', default=[50, 500])
+    args = parser.parse_args()
+    print(json.dumps([bench(page_size, args.iterations) for page_size in args.page_size], indent=2))
+
+
+if __name__ == '__main__':
+    main()
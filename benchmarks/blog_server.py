@@ -0,0 +1,163 @@
+"""Local stand-in for blog.griddynamics serving the saved fixture pages
+
+The recorded pages are used as templates and amplified to any number of synthetic articles, sections and authors:
+
+* /                          home page with a '.card.viewall' link per section
+* /section-<s>/[page/<p>/]   multi-record pages with article cards, paginated with rel=next
+* /article-<i>/              article child pages
+* /author/author-<k>         author child pages
+"""
+import os
+import re
+import string
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+NEWEST_DATE = date(2020, 3, 30)
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as page:
+        return page.read()
+
+
+class SyntheticBlog:
+    """Generates blog pages for articles numbered from 0 (newest) to articles - 1 (oldest)"""
+
+    def __init__(self, articles=200, sections=5, authors=20, page_size=50, articles_per_day=3):
+        self.articles = articles
+        self.sections = sections
+        self.authors = authors
+        self.page_size = page_size
+        self.articles_per_day = articles_per_day
+        self._home = string.Template(_fixture('home.html'))
+        self._section = string.Template(_fixture('section.html'))
+        self._author = string.Template(_fixture('author.html'))
+        self._article = _fixture('article.html')
+        self._author_articles = None
+
+    def pub_date(self, article):
+        return NEWEST_DATE - timedelta(days=article // self.articles_per_day)
+
+    def article_authors(self, article):
+        authors = [article % self.authors]
+        if article % 4 == 0 and self.authors > 1:
+            authors.append((article * 7 + 1) % self.authors)
+        return sorted(set(authors))
+
+    def author_articles(self, author):
+        if self._author_articles is None:
+            self._author_articles = [[] for _ in range(self.authors)]
+            for article in range(self.articles):
+                for article_author in self.article_authors(article):
+                    self._author_articles[article_author].append(article)
+        return self._author_articles[author]
+
+    @staticmethod
+    def _date_text(pub_date):
+        return '{} {}, {} •'.format(pub_date.strftime('%b'), pub_date.day, pub_date.year)
+
+    def _card(self, article, css_class):
+        return '      <a class="card {}" href="/article-{}/"><h4>Synthetic article {}</h4>' \
+               '<span class="name">{}</span></a>'.format(css_class, article, article,
+                                                         self._date_text(self.pub_date(article)))
+
+    def home_page(self):
+        sections = '\n'.join('      <a class="card viewall" href="/section-{}/">View all</a>'.format(section)
+                             for section in range(self.sections))
+        return self._home.substitute(sections=sections)
+
+    def section_page(self, section, page=1):
+        if section >= self.sections:
+            return None
+        articles = list(range(section, self.articles, self.sections))
+        listed = articles[(page - 1) * self.page_size:page * self.page_size]
+        if page > 1 and not listed:
+            return None
+        pagination = ''
+        if page * self.page_size < len(articles):
+            pagination = '  <link rel="next" href="/section-{}/page/{}/">'.format(section, page + 1)
+        featured = self._card(articles[0], 'featured') if page == 1 and articles else ''
+        return self._section.substitute(
+            title='Section {}'.format(section), pagination=pagination, featured=featured,
+            cards='\n'.join(self._card(article, 'cardtocheck') for article in listed))
+
+    def article_page(self, article):
+        if article >= self.articles:
+            return None
+        authors = '\n'.join('        <a class="goauthor" href="/author/author-{0}">\n'
+                            '          <span class="name">Author {0}</span>\n'
+                            '        </a>'.format(author) for author in self.article_authors(article))
+        page = re.sub(r'<div class="authwrp">.*?<span class="sdate">',
+                      '<div class="authwrp">\n{}\n        <span class="sdate">'.format(authors),
+                      self._article, count=1, flags=re.S)
+        page = page.replace('Mar 13, 2020 •', self._date_text(self.pub_date(article)))
+        return page.replace('Boosting product discovery with semantic search', 'Synthetic article {}'.format(article))
+
+    def author_page(self, author):
+        if author >= self.authors:
+            return None
+        posts = '\n'.join('        <a href="/article-{0}/">Synthetic article {0}</a>'.format(article)
+                          for article in self.author_articles(author))
+        return self._author.substitute(name='Author {}'.format(author), job_title='Engineer',
+                                       slug='author-{}'.format(author), posts=posts)
+
+    ROUTES = (
+        (re.compile(r'^/$'), lambda blog: blog.home_page()),
+        (re.compile(r'^/section-(\d+)/$'), lambda blog, section: blog.section_page(int(section))),
+        (re.compile(r'^/section-(\d+)/page/(\d+)/$'),
+         lambda blog, section, page: blog.section_page(int(section), int(page))),
+        (re.compile(r'^/article-(\d+)/$'), lambda blog, article: blog.article_page(int(article))),
+        (re.compile(r'^/author/author-(\d+)/?$'), lambda blog, author: blog.author_page(int(author))),
+    )
+
+    def render(self, path):
+        """:returns the page for the path or None if there is no such page"""
+
+        for pattern, render in self.ROUTES:
+            match = pattern.match(path)
+            if match:
+                return render(self, *match.groups())
+        return None
+
+
+def _handler(blog):
+    class BlogRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            page = blog.render(self.path.split('?')[0])
+            body = (page or 'Not found').encode('utf-8')
+            self.send_response(200 if page is not None else 404)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return BlogRequestHandler
+
+
+def serve(blog, port=0, ready=None):
+    """Serves the blog until the process is terminated, the bound port is put into the ready queue"""
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(blog))
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server_process(blog):
+    """Starts serving the blog in a separate process so it does not compete with the crawler for the GIL
+
+    :returns the process and the root url of the served blog
+    """
+
+    ready = Queue()
+    process = Process(target=serve, args=(blog, 0, ready), daemon=True)
+    process.start()
+    return process, 'http://127.0.0.1:{}'.format(ready.get(timeout=30))
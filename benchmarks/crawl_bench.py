@@ -0,0 +1,161 @@
+"""Crawls a local synthetic copy of the blog and reports crawler throughput as JSON
+
+Run from the project root: python -m benchmarks.crawl_bench --articles 10000 --output bench.json
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+from collections import Counter
+from scrapy import signals
+from sqlalchemy import func
+from scrapy.crawler import CrawlerProcess
+from grid_blog_crawl.metrics import REGISTRY
+from grid_blog_crawl.pipelines import GridBlogSpiderPipeline
+from grid_blog_crawl.spiders.article_spider import ArticleSpider
+from grid_blog_crawl.spiders.author_spider import AuthorSpider
+from models import DatabaseController, Article, Author, AuthorArticleRelation
+from scrape import get_crawl_settings, start_sequentially
+from .blog_server import SyntheticBlog, start_server_process
+
+
+class TimedPipeline(GridBlogSpiderPipeline):
+    """GridBlogSpiderPipeline that records how long processing of every item takes"""
+
+    latencies = []
+
+    def process_item(self, item, spider):
+        started = time.perf_counter()
+        try:
+            return super().process_item(item, spider)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+class CrawlCounters:
+    """Extension counting downloaded pages and scraped items of every crawler"""
+
+    pages = 0
+    items = Counter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls()
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def response_received(self, response, request, spider):
+        CrawlCounters.pages += 1
+
+    def item_scraped(self, item, response, spider):
+        CrawlCounters.items[type(item).__name__] += 1
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """:returns the given percentiles of the values, nearest-rank method"""
+
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {'p{}'.format(point): ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))]
+              for point in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def stage_totals():
+    """:returns seconds spent and number of observations per crawl stage, taken from the metrics registry"""
+
+    stages = {}
+    for metric in ('crawl_download_latency_seconds', 'crawl_parse_seconds', 'pipeline_db_write_seconds'):
+        histogram = REGISTRY.get(metric)
+        for labels, (count, total) in (histogram.totals().items() if histogram else ()):
+            name = '{}{{{}}}'.format(metric, ','.join('{}={}'.format(*label) for label in labels))
+            stages[name] = {'count': count, 'seconds': round(total, 4)}
+    return stages
+
+
+def run(blog, database_path, stream_authors=False, concurrency=16, profile=None):
+    """Crawls the blog served by a local server into database_path
+
+    :returns dict with the benchmark results
+    """
+
+    server, root_url = start_server_process(blog)
+    try:
+        settings = get_crawl_settings(profile)
+        settings.setdict({
+            'ROOT_URL': root_url,
+            'DATABASE_NAME': database_path,
+            'ROBOTSTXT_OBEY': False,
+            'HTTPCACHE_ENABLED': False,
+            'TELNETCONSOLE_ENABLED': False,
+            'LOG_LEVEL': 'WARNING',
+            'CONCURRENT_REQUESTS': concurrency,
+            'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+            'STREAM_AUTHORS': stream_authors,
+            'ITEM_PIPELINES': {'{}.TimedPipeline'.format(__name__): 300},
+            'EXTENSIONS': dict(settings.getdict('EXTENSIONS'), **{'{}.CrawlCounters'.format(__name__): 0}),
+        }, priority='cmdline')
+        process = CrawlerProcess(settings=settings)
+        started = time.perf_counter()
+        start_sequentially(process, [ArticleSpider] if stream_authors else [ArticleSpider, AuthorSpider])
+        process.start()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+
+    dbc = DatabaseController(database_path)
+    with dbc.session_scope() as session:
+        db_rows = {model.__tablename__: session.query(func.count()).select_from(model).scalar()
+                   for model in (Article, Author, AuthorArticleRelation)}
+    dbc.dispose()
+    items = sum(CrawlCounters.items.values())
+    result = {
+        'config': {'articles': blog.articles, 'sections': blog.sections, 'authors': blog.authors,
+                   'page_size': blog.page_size, 'stream_authors': stream_authors, 'concurrency': concurrency,
+                   'profile': profile},
+        'elapsed_s': round(elapsed, 3),
+        'pages': CrawlCounters.pages,
+        'pages_per_s': round(CrawlCounters.pages / elapsed, 2),
+        'items': items,
+        'items_per_s': round(items / elapsed, 2),
+        'items_by_type': dict(CrawlCounters.items),
+        'pipeline_latency_ms': {name: round(value * 1000, 4)
+                                for name, value in percentiles(TimedPipeline.latencies).items()},
+        'stages': stage_totals(),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'db_rows': db_rows,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--articles', type=int, default=200, help="number of synthetic articles")
+    parser.add_argument('--sections', type=int, default=5)
+    parser.add_argument('--authors', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=50, help="cards per multi-record page")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--profile', help="crawl profile from CRAWL_PROFILES setting")
+    parser.add_argument('--stream-authors', action='store_true')
+    parser.add_argument('--output', help="file to write the JSON results to, stdout when not given")
+    args = parser.parse_args()
+
+    blog = SyntheticBlog(args.articles, args.sections, args.authors, args.page_size)
+    with tempfile.TemporaryDirectory() as directory:
+        result = run(blog, os.path.join(directory, 'bench.db'), args.stream_authors, args.concurrency,
+                     args.profile)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
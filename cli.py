@@ -0,0 +1,215 @@
+"""Command line entry point of the blog crawler and report
+
+Heavy dependencies are imported by the subcommands that need them, so `python3 cli.py report` does not load scrapy.
+Plots are rendered on explicit Agg figures and only when their data changed since they were rendered last.
+"""
+import argparse
+import json
+import logging
+import sys
+from datetime import date
+
+from grid_blog_crawl.settings import DATABASE_NAME
+
+
+def crawl(args):
+    from scrape import start
+
+    try:
+        start(stream_authors=args.stream_authors, profile=args.profile, shards=args.shards)
+    except ValueError as error:
+        sys.exit(str(error))
+
+
+def report(args):
+    from models import DatabaseController
+    from report import format_tables, get_report_tables, save_plots
+
+    dbc = DatabaseController.shared(args.database)
+    if args.output_dir:
+        for path in save_plots(dbc, args.output_dir, args.image_format, args.render_processes):
+            logging.info("Plot written to {}".format(path))
+    print(format_tables(get_report_tables(dbc), args.table_format))
+
+
+def both(args):
+    crawl(args)
+    report(args)
+
+
+def search(args):
+    from models import DatabaseController
+    from report import format_tables, search_articles
+
+    try:
+        results = search_articles(DatabaseController.shared(args.database), args.query, args.limit, args.tag,
+                                  args.since)
+    except ValueError as error:
+        sys.exit(str(error))
+    print(format_tables({"search": results}, args.table_format))
+
+
+def export(args):
+    from models import DatabaseController
+    from export import export as export_tables
+
+    try:
+        exported = export_tables(DatabaseController.shared(args.database), args.output_dir, args.format,
+                                 args.incremental, args.chunk_size)
+    except RuntimeError as error:
+        sys.exit(str(error))
+    print(json.dumps(exported))
+
+
+def body_stats(args):
+    from models import DatabaseController
+
+    print(json.dumps(DatabaseController.shared(args.database).get_body_stats(), indent=2))
+
+
+def rebuild(args):
+    from models import DatabaseController
+
+    DatabaseController.shared(args.database).rebuild_summaries()
+
+
+def graph(args):
+    import time
+    from models import DatabaseController
+    from graph import RelationGraph
+
+    started = time.perf_counter()
+    RelationGraph.build(DatabaseController.shared(args.database)).save(args.output)
+    logging.info("Graph written to {} in {:.2f}s".format(args.output, time.perf_counter() - started))
+
+
+def author_profile(args):
+    from graph import RelationGraph
+
+    relation_graph = RelationGraph.load(args.graph)
+    try:
+        profile = {"articles": relation_graph.articles_of(args.author_url),
+                   "coauthors": dict(relation_graph.coauthor_counts(args.author_url).most_common()),
+                   "tags": dict(relation_graph.tag_histogram(args.author_url).most_common())}
+    except KeyError:
+        sys.exit("No articles of {} in {}".format(args.author_url, args.graph))
+    print(json.dumps(profile, indent=2))
+
+
+def trends(args):
+    from models import DatabaseController
+    from report import format_tables, growing_tags, trend
+
+    dbc = DatabaseController.shared(args.database)
+    try:
+        if args.tag or args.author_url:
+            tables = {"trend": trend(dbc, args.period, args.window, args.tag, args.author_url, args.since,
+                                     args.until)}
+        else:
+            tables = {"growing_tags": growing_tags(dbc, args.weeks, args.limit, args.until)}
+    except ValueError as error:
+        sys.exit(str(error))
+    print(format_tables(tables, args.table_format))
+
+
+def _add_crawl_arguments(parser):
+    parser.add_argument('--profile', help="crawl profile from CRAWL_PROFILES setting")
+    parser.add_argument('--stream-authors', action='store_true', default=None,
+                        help="crawl author pages together with the articles")
+    parser.add_argument('--shards', type=int, help="number of worker processes to split the crawl across")
+
+
+def _add_report_arguments(parser):
+    parser.add_argument('--output-dir', help="directory to render the plots into, plots are skipped when not given")
+    parser.add_argument('--image-format', choices=("png", "svg"), default="png")
+    parser.add_argument('--render-processes', type=int,
+                        help="processes rendering the plots, the number of CPUs by default")
+    parser.add_argument('--table-format', choices=("json", "csv"), default="json",
+                        help="format the report tables are printed in")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Scrapes blog.griddynamics and reports on the scraped data")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser('crawl', help="scrape the blog into the database")
+    _add_crawl_arguments(crawl_parser)
+    crawl_parser.set_defaults(handler=crawl)
+
+    report_parser = subparsers.add_parser('report', help="report on the database without crawling")
+    _add_report_arguments(report_parser)
+    report_parser.add_argument('--database', default=DATABASE_NAME, help="database file to report on")
+    report_parser.set_defaults(handler=report)
+
+    both_parser = subparsers.add_parser('both', help="crawl and then report")
+    _add_crawl_arguments(both_parser)
+    _add_report_arguments(both_parser)
+    both_parser.set_defaults(handler=both, database=DATABASE_NAME)
+
+    search_parser = subparsers.add_parser('search', help="full-text search over the scraped articles")
+    search_parser.add_argument('query',
+                               help="FTS5 query, e.g. 'semantic search' or '\"product discovery\" OR autocomplete'")
+    search_parser.add_argument('--limit', type=int, default=10)
+    search_parser.add_argument('--tag', help="only search articles labeled with the tag")
+    search_parser.add_argument('--since', type=date.fromisoformat,
+                               help="only search articles published since YYYY-MM-DD")
+    search_parser.add_argument('--table-format', choices=("json", "csv"), default="json")
+    search_parser.add_argument('--database', default=DATABASE_NAME)
+    search_parser.set_defaults(handler=search)
+
+    export_parser = subparsers.add_parser('export', help="stream the scraped tables to JSONL or Parquet files")
+    export_parser.add_argument('output_dir')
+    export_parser.add_argument('--format', choices=("jsonl", "parquet"), default="jsonl",
+                               help="parquet needs the pyarrow package")
+    export_parser.add_argument('--incremental', action='store_true',
+                               help="only export rows updated since the previous export into output_dir")
+    export_parser.add_argument('--chunk-size', type=int, default=1000, help="rows fetched and written at a time")
+    export_parser.add_argument('--database', default=DATABASE_NAME)
+    export_parser.set_defaults(handler=export)
+
+    body_stats_parser = subparsers.add_parser('body-stats',
+                                              help="bytes per article and compression ratio of the captured bodies")
+    body_stats_parser.add_argument('--database', default=DATABASE_NAME)
+    body_stats_parser.set_defaults(handler=body_stats)
+
+    rebuild_parser = subparsers.add_parser('rebuild', help="recompute the report summary tables")
+    rebuild_parser.add_argument('--database', default=DATABASE_NAME)
+    rebuild_parser.set_defaults(handler=rebuild)
+
+    graph_parser = subparsers.add_parser('graph', help="save the author-article graph into a memory mapped file")
+    graph_parser.add_argument('output')
+    graph_parser.add_argument('--database', default=DATABASE_NAME)
+    graph_parser.set_defaults(handler=graph)
+
+    profile_parser = subparsers.add_parser('author-profile',
+                                           help="articles, coauthors and tags of an author from a saved graph")
+    profile_parser.add_argument('author_url')
+    profile_parser.add_argument('--graph', required=True, help="file written by the graph command")
+    profile_parser.set_defaults(handler=author_profile)
+
+    trends_parser = subparsers.add_parser('trends', help="fastest growing tags, or the rolling article counts of a "
+                                                         "tag or an author")
+    trends_parser.add_argument('--weeks', type=int, default=4,
+                               help="weeks compared with the weeks before them for the growing tags")
+    trends_parser.add_argument('--limit', type=int, default=10)
+    trends_parser.add_argument('--tag', help="rolling article counts of the tag")
+    trends_parser.add_argument('--author-url', help="rolling article counts of the author")
+    trends_parser.add_argument('--period', choices=("week", "month"), default="week")
+    trends_parser.add_argument('--window', type=int, default=4, help="buckets summed by the rolling counts")
+    trends_parser.add_argument('--since', type=date.fromisoformat, help="first YYYY-MM-DD of the rolling counts")
+    trends_parser.add_argument('--until', type=date.fromisoformat,
+                               help="last YYYY-MM-DD, the newest week with tagged articles by default")
+    trends_parser.add_argument('--table-format', choices=("json", "csv"), default="json")
+    trends_parser.add_argument('--database', default=DATABASE_NAME)
+    trends_parser.set_defaults(handler=trends)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Streams the crawl tables to JSONL or Parquet files for the analytics
+
+Articles are partitioned by publication date, authors and author-article relations are written unpartitioned:
+
+    <output>/articles/year=2020/month=03/part-<run>.<format>
+    <output>/authors/part-<run>.<format>
+    <output>/author_article/part-<run>.<format>
+
+Every run adds new part files. The watermark of the last run is kept in <output>/_export_state.json, an incremental
+run only exports the rows updated after it. Rows may be exported again by the next incremental run, consumers should
+deduplicate them by the primary key of the table.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import sqlalchemy as db
+from models import Article, Author, AuthorArticleRelation, DatabaseController
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger("Exporter")
+
+FORMATS = ("jsonl", "parquet")
+STATE_FILE = "_export_state.json"
+# rows committed shortly before the run started may not be visible to it, the next run exports them again
+WATERMARK_LAG = timedelta(minutes=1)
+EXPORTED_MODELS = (Article, Author, AuthorArticleRelation)
+
+
+def _partition(model, row):
+    """:returns the partition directory of the row relative to its table directory"""
+
+    if model is Article:
+        return os.path.join("year={}".format(row["pub_date"].year), "month={:02d}".format(row["pub_date"].month))
+    return ""
+
+
+class JsonLinesPartWriter:
+    """Writes rows of one partition as JSON objects, one per line"""
+
+    extension = "jsonl"
+
+    def __init__(self, path, columns):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row, default=lambda value: value.isoformat(), ensure_ascii=False))
+            self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+
+def _arrow_type(column):
+    if isinstance(column.type, db.DateTime):
+        return pyarrow.timestamp("us")
+    if isinstance(column.type, db.Date):
+        return pyarrow.date32()
+    if isinstance(column.type, db.Integer):
+        return pyarrow.int64()
+    if isinstance(column.type, db.LargeBinary):
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+class ParquetPartWriter:
+    """Writes rows of one partition into a Parquet file, a row group per write"""
+
+    extension = "parquet"
+
+    def __init__(self, path, columns):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is needed for the Parquet export")
+        self.schema = pyarrow.schema([(column.name, _arrow_type(column)) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        self.writer.write_table(pyarrow.Table.from_pydict(
+            {name: [row[name] for row in rows] for name in self.schema.names}, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+PART_WRITERS = {"jsonl": JsonLinesPartWriter, "parquet": ParquetPartWriter}
+
+
+def read_watermark(output_dir):
+    """:returns the watermark of the last export into output_dir or None if there was none"""
+
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return datetime.fromisoformat(json.load(file)["watermark"])
+
+
+def _write_watermark(output_dir, watermark):
+    path = os.path.join(output_dir, STATE_FILE)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump({"watermark": watermark.isoformat()}, file)
+    os.replace(temporary, path)
+
+
+def export_table(dbc: DatabaseController, model, output_dir, run, export_format="jsonl", since=None,
+                 chunk_size=1000):
+    """Streams the table of the model into part files of its partitions, at most chunk_size rows are held in memory
+
+    :returns number of exported rows
+    """
+
+    part_writer = PART_WRITERS[export_format]
+    columns = list(model.__table__.columns)
+    order_by = (Article.pub_date, Article.url) if model is Article else model.__table__.primary_key.columns
+    writers = {}
+    chunk = []
+    partition = None
+    count = 0
+
+    def flush():
+        if not chunk:
+            return
+        if partition not in writers:
+            directory = os.path.join(output_dir, model.__tablename__, partition)
+            os.makedirs(directory, exist_ok=True)
+            writers[partition] = part_writer(
+                os.path.join(directory, "part-{}.{}".format(run, part_writer.extension)), columns)
+        writers[partition].write(chunk)
+        chunk.clear()
+
+    try:
+        for row in dbc.stream_rows(model, since, chunk_size, order_by):
+            row_partition = _partition(model, row)
+            if row_partition != partition:
+                flush()
+                # rows come ordered by partition, so the finished partition can be closed
+                if partition in writers:
+                    writers.pop(partition).close()
+                partition = row_partition
+            chunk.append(row)
+            count += 1
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return count
+
+
+def export(dbc: DatabaseController, output_dir, export_format="jsonl", incremental=False, chunk_size=1000):
+    """Exports the articles, authors and author-article relations into output_dir
+
+    :param incremental: only export rows updated since the previous export into output_dir
+    :returns dict of table name to number of exported rows
+    """
+
+    if export_format not in FORMATS:
+        raise ValueError("Unknown export format {}, expected one of {}".format(export_format, ", ".join(FORMATS)))
+    if export_format == "parquet" and pyarrow is None:
+        raise RuntimeError("pyarrow is needed for the Parquet export")
+    started = datetime.utcnow()
+    since = read_watermark(output_dir) if incremental else None
+    run = started.strftime("%Y%m%dT%H%M%S%f")
+    os.makedirs(output_dir, exist_ok=True)
+    exported = {}
+    for model in EXPORTED_MODELS:
+        exported[model.__tablename__] = export_table(dbc, model, output_dir, run, export_format, since, chunk_size)
+        log.info("Exported {} {} rows".format(exported[model.__tablename__], model.__tablename__))
+    _write_watermark(output_dir, started - WATERMARK_LAG)
+    return exported
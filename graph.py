@@ -0,0 +1,203 @@
+"""Compact in-memory graph of the author-article relation for the analytics
+
+Authors, articles and tags are interned to integers in the sorted order of their urls and names, the relation is
+kept as CSR adjacency arrays in both directions, together with the tags of every article:
+
+    author_indptr[a]:author_indptr[a + 1]      -> author_articles, ids of the articles of author a
+    article_indptr[r]:article_indptr[r + 1]    -> article_authors, ids of the authors of article r
+    tag_indptr[r]:tag_indptr[r + 1]            -> article_tags, ids of the tags of article r
+
+The graph is saved as one file of aligned raw arrays behind a JSON header, loading memory maps the arrays, urls are
+looked up by binary search in the sorted fixed width url arrays, so nothing is parsed or hashed on load.
+"""
+import json
+import logging
+import struct
+from collections import Counter
+
+import numpy as np
+from models import Article, AuthorArticleRelation, DatabaseController, split_tags
+
+log = logging.getLogger("Relation Graph")
+
+MAGIC = b"RELGRAPH1\n"
+ALIGNMENT = 64
+ARRAYS = ("author_urls", "article_urls", "tag_names", "author_indptr", "author_articles", "article_indptr",
+          "article_authors", "tag_indptr", "article_tags")
+
+
+class _Interner:
+    """Assigns increasing integers to the values in the order they are first seen"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, value):
+        return self.ids.setdefault(value, len(self.ids))
+
+    def sorted(self):
+        """:returns the values as a sorted fixed width bytes array and the sorted position of every assigned id"""
+
+        values = np.array([value.encode("utf-8") for value in self.ids], dtype=bytes)
+        order = np.argsort(values, kind="stable")
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        return values[order], rank
+
+
+def _aligned(size):
+    """:returns size rounded up to a multiple of ALIGNMENT"""
+
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _csr(sources, targets, size):
+    """:returns indptr and the targets grouped by source, targets of a source are sorted"""
+
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+
+class RelationGraph:
+    """Author-article relation and article tags as CSR arrays, see the module docstring"""
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, dbc: DatabaseController, chunk_size=1000):
+        """:returns the graph built with one streaming pass over author_article and one over articles"""
+
+        authors, articles, tags = _Interner(), _Interner(), _Interner()
+        relation_authors, relation_articles = [], []
+        for row in dbc.stream_rows(AuthorArticleRelation, chunk_size=chunk_size):
+            relation_authors.append(authors(row["author_url"]))
+            relation_articles.append(articles(row["article_url"]))
+        tagged_articles, article_tags = [], []
+        for row in dbc.stream_rows(Article, chunk_size=chunk_size):
+            article = articles(row["url"])
+            for tag in split_tags(row["tags"]):
+                tagged_articles.append(article)
+                article_tags.append(tags(tag))
+
+        author_urls, author_rank = authors.sorted()
+        article_urls, article_rank = articles.sorted()
+        tag_names, tag_rank = tags.sorted()
+        relation_authors = author_rank[np.array(relation_authors, dtype=np.int64)]
+        relation_articles = article_rank[np.array(relation_articles, dtype=np.int64)]
+        tagged_articles = article_rank[np.array(tagged_articles, dtype=np.int64)]
+        article_tags = tag_rank[np.array(article_tags, dtype=np.int64)]
+
+        arrays = {"author_urls": author_urls, "article_urls": article_urls, "tag_names": tag_names}
+        arrays["author_indptr"], arrays["author_articles"] = _csr(relation_authors, relation_articles,
+                                                                  len(author_urls))
+        arrays["article_indptr"], arrays["article_authors"] = _csr(relation_articles, relation_authors,
+                                                                   len(article_urls))
+        arrays["tag_indptr"], arrays["article_tags"] = _csr(tagged_articles, article_tags, len(article_urls))
+        log.info("Built graph of {} authors, {} articles and {} relations".format(
+            len(author_urls), len(article_urls), len(relation_authors)))
+        return cls(arrays)
+
+    def save(self, path):
+        """Writes the graph into the file at path"""
+
+        header, offset = {}, 0
+        for name in ARRAYS:
+            array = getattr(self, name)
+            header[name] = {"dtype": array.dtype.str, "shape": array.shape, "offset": offset}
+            offset += _aligned(array.nbytes)
+        encoded = json.dumps(header).encode("utf-8")
+        start = _aligned(len(MAGIC) + 8 + len(encoded))
+        with open(path, "wb") as file:
+            file.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+            for name in ARRAYS:
+                file.seek(start + header[name]["offset"])
+                file.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+            file.truncate(start + offset)
+
+    @classmethod
+    def load(cls, path):
+        """:returns the graph saved at path with its arrays memory mapped read-only"""
+
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a relation graph file".format(path))
+            length, = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(length))
+        start = _aligned(len(MAGIC) + 8 + length)
+        arrays = {}
+        for name in ARRAYS:
+            spec = header[name]
+            shape = tuple(spec["shape"])
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=spec["dtype"])
+            else:
+                arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=start + spec["offset"],
+                                         shape=shape)
+        return cls(arrays)
+
+    @staticmethod
+    def _index(urls, url):
+        key = url.encode("utf-8")
+        index = int(np.searchsorted(urls, key))
+        if index == len(urls) or urls[index] != key:
+            raise KeyError(url)
+        return index
+
+    def author_id(self, author_url):
+        """:returns integer id of the author, :raises KeyError: for authors without relations"""
+
+        return self._index(self.author_urls, author_url)
+
+    def article_id(self, article_url):
+        """:returns integer id of the article, :raises KeyError: for unknown articles"""
+
+        return self._index(self.article_urls, article_url)
+
+    def _article_ids(self, author):
+        return self.author_articles[self.author_indptr[author]:self.author_indptr[author + 1]]
+
+    def articles_of(self, author_url):
+        """:returns sorted urls of the articles of the author"""
+
+        return [self.article_urls[article].decode("utf-8")
+                for article in self._article_ids(self.author_id(author_url))]
+
+    def authors_of(self, article_url):
+        """:returns sorted urls of the authors of the article"""
+
+        article = self.article_id(article_url)
+        return [self.author_urls[author].decode("utf-8")
+                for author in self.article_authors[self.article_indptr[article]:self.article_indptr[article + 1]]]
+
+    def relation_counts(self):
+        """:returns dict of author url to the number of its articles, the count compare_article_counts checks"""
+
+        return dict(zip((url.decode("utf-8") for url in self.author_urls), np.diff(self.author_indptr).tolist()))
+
+    def _gather(self, indptr, values, ids):
+        """:returns values of the CSR rows with the given ids concatenated"""
+
+        if not len(ids):
+            return np.empty(0, dtype=values.dtype)
+        return np.concatenate([values[indptr[row]:indptr[row + 1]] for row in ids])
+
+    def coauthor_counts(self, author_url):
+        """:returns Counter of coauthor url to the number of articles written together with the author"""
+
+        author = self.author_id(author_url)
+        coauthors = self._gather(self.article_indptr, self.article_authors, self._article_ids(author))
+        counts = np.bincount(coauthors, minlength=len(self.author_urls))
+        counts[author] = 0
+        return Counter({self.author_urls[coauthor].decode("utf-8"): int(counts[coauthor])
+                        for coauthor in np.flatnonzero(counts)})
+
+    def tag_histogram(self, author_url):
+        """:returns Counter of tag to the number of articles of the author labeled with it"""
+
+        tags = self._gather(self.tag_indptr, self.article_tags, self._article_ids(self.author_id(author_url)))
+        counts = np.bincount(tags, minlength=len(self.tag_names))
+        return Counter({self.tag_names[tag].decode("utf-8"): int(counts[tag]) for tag in np.flatnonzero(counts)})
@@ -0,0 +1,44 @@
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+from models import DatabaseController
+from .metrics import REGISTRY
+from .urls import canonicalize_url
+
+DUPLICATE_REQUESTS = REGISTRY.counter('crawl_duplicate_requests_total',
+                                      'Requests filtered as duplicates, by the crawl that saw the url first')
+
+
+class SeenUrlDupeFilter(RFPDupeFilter):
+    """Request dupe filter keyed on the canonical url, that also filters urls scraped by earlier crawls
+
+    Only requests with dedupe_across_runs in their meta are checked against the urls seen by earlier crawls, the
+    others are deduplicated within the crawl only.
+    """
+
+    def __init__(self, path=None, debug=False, db_name=None):
+        super().__init__(path, debug)
+        self.db_name = db_name
+        self.seen_urls = frozenset()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(job_dir(settings), settings.getbool('DUPEFILTER_DEBUG'),
+                   settings.get('DATABASE_NAME') if settings.getbool('SEEN_URLS_ENABLED') else None)
+
+    def open(self):
+        if self.db_name:
+            self.seen_urls = DatabaseController.shared(self.db_name).get_seen_urls()
+            self.logger.info('Loaded {} urls seen by earlier crawls'.format(len(self.seen_urls)))
+
+    def request_seen(self, request):
+        if request.meta.get('dedupe_across_runs') and canonicalize_url(request.url) in self.seen_urls:
+            DUPLICATE_REQUESTS.inc(seen='earlier_crawl')
+            return True
+        if super().request_seen(request):
+            DUPLICATE_REQUESTS.inc(seen='this_crawl')
+            return True
+        return False
+
+    def request_fingerprint(self, request):
+        return super().request_fingerprint(request.replace(url=canonicalize_url(request.url)))
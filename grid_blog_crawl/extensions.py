@@ -0,0 +1,61 @@
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from .metrics import REGISTRY
+
+DOWNLOAD_LATENCY = REGISTRY.histogram('crawl_download_latency_seconds', 'Time from sending a request to its response')
+RESPONSES = REGISTRY.counter('crawl_responses_total', 'Downloaded responses by status')
+ITEMS = REGISTRY.counter('crawl_items_total', 'Scraped items by type')
+QUEUE_DEPTH = REGISTRY.gauge('crawl_scheduler_queue_depth', 'Requests waiting in the scheduler')
+ACTIVE_DOWNLOADS = REGISTRY.gauge('crawl_downloader_active_requests', 'Requests being downloaded')
+SCRAPER_ACTIVE = REGISTRY.gauge('crawl_scraper_active_responses', 'Responses and items being processed')
+QUEUE_DEPTH_SAMPLES = REGISTRY.histogram('crawl_scheduler_queue_depth_samples', 'Sampled scheduler queue depth',
+                                         buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+
+
+class MetricsExtension:
+    """Records download latency, items per type and queue depth of the crawl into the metrics registry"""
+
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        extension = cls(crawler, crawler.settings.getfloat('METRICS_QUEUE_INTERVAL'))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self.sample_queues, spider)
+        self.task.start(self.interval)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+
+    def sample_queues(self, spider):
+        """Samples the number of requests and items waiting in every stage of the engine"""
+
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        depth = len(engine.slot.scheduler)
+        QUEUE_DEPTH.set(depth, spider=spider.name)
+        QUEUE_DEPTH_SAMPLES.observe(depth, spider=spider.name)
+        ACTIVE_DOWNLOADS.set(len(engine.downloader.active), spider=spider.name)
+        SCRAPER_ACTIVE.set(len(engine.scraper.slot.active) if engine.scraper.slot else 0, spider=spider.name)
+
+    def response_received(self, response, request, spider):
+        RESPONSES.inc(spider=spider.name, status=response.status)
+        if 'download_latency' in request.meta:
+            DOWNLOAD_LATENCY.observe(request.meta['download_latency'], spider=spider.name)
+
+    def item_scraped(self, item, response, spider):
+        ITEMS.inc(spider=spider.name, type=type(item).__name__)
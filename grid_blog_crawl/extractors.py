@@ -0,0 +1,129 @@
+import hashlib
+import re
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+from .items import ArticleItem, ArticleAuthorItem, extract_date, relative_to_absolute_url
+from .urls import canonicalize_url
+
+TEXT_LENGTH = 160
+
+
+def _compile(css, suffix=''):
+    """Translates the css selector to XPath once and compiles it"""
+
+    return etree.XPath(HTMLTranslator().css_to_xpath(css) + suffix)
+
+
+_TITLE = _compile('#woe #hero h2', '/text()')
+_PUB_DATE = _compile('#woe #hero .authwrp .sdate', '/text()')
+_POSTBODY = _compile('#woe .postbody')
+_TAGS = _compile("head meta[property='article:tag']", '/@content')
+_AUTHORS = _compile('.goauthor', '/@href')
+_REGULAR_CARDS = _compile('a.card.cardtocheck')
+_FEATURED_CARDS = _compile('.card.featured')
+_CARD_DATE = etree.XPath(HTMLTranslator().css_to_xpath('span.name', prefix='descendant::') + '/text()')
+
+
+def _first(values):
+    """:returns first value that is not None or empty, same as TakeFirst processor"""
+
+    for value in values:
+        if value is not None and value != '':
+            return value
+    return None
+
+
+def _short_text(root):
+    """:returns the stripped text of the post body cut to TEXT_LENGTH, reading only as much text as needed"""
+
+    parts = []
+    length = 0
+    for postbody in _POSTBODY(root):
+        for text in postbody.itertext():
+            text = text.strip()
+            parts.append(text)
+            length += len(text)
+            if length >= TEXT_LENGTH:
+                return ''.join(parts)[:TEXT_LENGTH]
+    return ''.join(parts)[:TEXT_LENGTH]
+
+
+_WHITESPACE = re.compile(rb'\s+')
+
+
+def page_fingerprint(response, headers=('Content-Type', 'Content-Language')):
+    """:returns sha1 hex digest of the page body with whitespace collapsed and of the given response headers
+
+    Computed from the raw bytes, without parsing the page.
+    """
+
+    digest = hashlib.sha1(_WHITESPACE.sub(b' ', response.body).strip())
+    for header in headers:
+        digest.update(b'\0' + header.encode('ascii') + b':' + (response.headers.get(header) or b''))
+    return digest.hexdigest()
+
+
+def extract_body(response):
+    """:returns the full text of the post body, one line per text node"""
+
+    return '\n'.join(text for postbody in _POSTBODY(response.selector.root)
+                     for text in map(str.strip, postbody.itertext()) if text)
+
+
+def extract_cards(response, root_url=None):
+    """:returns (canonical url, publication date or None) of every regular and then every featured article card of
+    the multi record page, without building a selector per card"""
+
+    root = response.selector.root
+    cards = []
+    for card in _REGULAR_CARDS(root) + _FEATURED_CARDS(root):
+        href = card.get('href')
+        if href is None:
+            continue
+        try:
+            pub_date = extract_date(''.join(_CARD_DATE(card)))
+        except ValueError:
+            pub_date = None
+        cards.append((canonicalize_url(href, root_url), pub_date))
+    return cards
+
+
+def cards_after(cards, watermark):
+    """:returns urls of the cards newer than the watermark, cards from the watermark date are new unless their url
+    is one of the watermark urls and cards without a date are always new"""
+
+    watermark_date, watermark_urls = watermark
+    if watermark_date is None:
+        return [url for url, _ in cards]
+    return [url for url, pub_date in cards if pub_date is None or pub_date > watermark_date
+            or (pub_date == watermark_date and url not in watermark_urls)]
+
+
+def extract_article(response, root_url=None):
+    """Extracts article item & author-article relation item from article child page in one pass
+
+    Produces the same items as the ItemLoader based parsing of ArticleSpider without running item loaders.
+    """
+
+    root = response.selector.root
+    url = canonicalize_url(response.url)
+    article_item = ArticleItem(url=url)
+    title = _first(_TITLE(root))
+    if title is not None:
+        article_item['title'] = str(title)
+    pub_date = _first(_PUB_DATE(root))
+    if pub_date is None:
+        raise ValueError('Article {} has no publication date'.format(response.url))
+    article_item['pub_date'] = extract_date(pub_date)
+    text = _short_text(root)
+    if text:
+        article_item['text'] = text
+    tags = ':::'.join(_TAGS(root))
+    if tags:
+        article_item['tags'] = tags
+
+    article_author_item = ArticleAuthorItem(
+        authors=[relative_to_absolute_url(str(href), {'root_url': root_url}) for href in _AUTHORS(root)],
+        article_url=url
+    )
+    return article_item, article_author_item
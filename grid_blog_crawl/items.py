@@ -1,19 +1,35 @@
+import re
 import scrapy
-from datetime import datetime
+from datetime import date
+from functools import lru_cache
 from scrapy.loader.processors import MapCompose, TakeFirst, Join
-from .settings import ROOT_URL
+from .urls import canonicalize_url
 
+_MONTHS = {month: number for number, month in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+_DATE = re.compile(r'\s*([a-z]{3})\s+(\d{1,2}),\s+(\d{4})\s+•\s*$', re.IGNORECASE)
 
+
+@lru_cache(maxsize=4096)
 def extract_date(date_extracted):
-    """Extracts date from str in format that is consistent on blog.griddynamics"""
+    """Extracts date from str in format that is consistent on blog.griddynamics, e.g. 'Mar 16, 2020 •'
+
+    Parsed with a month table instead of strptime, the results are cached as listing pages repeat the same dates.
+    :raises ValueError: if the str is not a date in that format
+    """
 
-    return datetime.strptime(date_extracted.strip(), "%b %d, %Y •").date()
+    match = _DATE.match(date_extracted)
+    if match is None or match.group(1).lower() not in _MONTHS:
+        raise ValueError("Date {!r} does not match format '%b %d, %Y •'".format(date_extracted))
+    month, day, year = match.groups()
+    return date(int(year), _MONTHS[month.lower()], int(day))
 
 
-def relative_to_absolute_url(relative):
-    """Converts author/article relative url to absolute url"""
+def relative_to_absolute_url(relative, loader_context=None):
+    """Converts author/article relative url to canonical absolute url, root_url of the loader context is used if
+    given"""
 
-    return ROOT_URL + relative
+    return canonicalize_url(relative, (loader_context or {}).get('root_url'))
 
 
 def shorten(string):
@@ -97,3 +113,36 @@ class AuthorItem(scrapy.Item):
         output_processor=TakeFirst()
     )
 
+
+class AuthorRefreshItem(scrapy.Item):
+    """scrapy.Item consisting the validators of a scraped author page, the page was scraped when the item is written"""
+
+    author_url = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+
+
+class ArticleBodyItem(scrapy.Item):
+    """scrapy.Item consisting the full text of an article body"""
+
+    article_url = scrapy.Field()
+    body = scrapy.Field()
+
+
+class ContentFingerprintItem(scrapy.Item):
+    """scrapy.Item consisting the fingerprint and validators of a parsed article page"""
+
+    url = scrapy.Field()
+    fingerprint = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+
+
+class SectionStateItem(scrapy.Item):
+    """scrapy.Item consisting the crawl state of a blog section, used by the next incremental crawl"""
+
+    section_url = scrapy.Field()
+    watermark = scrapy.Field()
+    watermark_urls = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
@@ -5,7 +5,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from .metrics import REGISTRY
+
+PARSE_TIME = REGISTRY.histogram('crawl_parse_seconds', 'Time spent in a spider callback per response')
 
 
 class GridBlogSpiderSpiderMiddleware(object):
@@ -101,3 +106,32 @@ class GridBlogSpiderDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class ParseTimingMiddleware(object):
+    """Spider middleware measuring the time the spider callbacks spend producing their output.
+
+    It has to be the closest middleware to the spider, so only the callback itself is measured.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        callback = response.request.callback if response.request is not None else None
+        name = getattr(callback, '__name__', 'parse')
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            started = time.perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                break
+            elapsed += time.perf_counter() - started
+            yield output
+        PARSE_TIME.observe(elapsed, spider=spider.name, callback=name)
@@ -1,43 +1,215 @@
-from models import DatabaseController, Author, Article, AuthorArticleRelation
-from .items import ArticleAuthorItem, ArticleItem
+import logging
+import time
+import zlib
+from collections import deque
+from datetime import timedelta
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+from models import DatabaseController
+from .items import ArticleAuthorItem, ArticleBodyItem, ArticleItem, AuthorItem, AuthorRefreshItem, \
+    ContentFingerprintItem, SectionStateItem
+from .metrics import REGISTRY
 from .spiders.article_spider import ArticleSpider
 from .spiders.author_spider import AuthorSpider
 
+log = logging.getLogger('Pipeline')
+
+DB_WRITE_LATENCY = REGISTRY.histogram('pipeline_db_write_seconds', 'Time spent writing a batch to the database')
+DB_ROWS_WRITTEN = REGISTRY.gauge('pipeline_db_rows_written', 'Rows written by the pipeline per table')
+DB_WRITE_QUEUE = REGISTRY.gauge('pipeline_db_write_queue', 'Batches waiting for or being written by the writer thread')
+DB_FAILED_BATCHES = REGISTRY.counter('pipeline_db_failed_batches_total',
+                                     'Batches whose rows were lost because writing them to the database failed')
+BACKPRESSURE_WAIT = REGISTRY.histogram('pipeline_backpressure_seconds',
+                                       'Time an item waited for room in the full write queue')
+
+
+def in_shard(url, shard_index, shard_count):
+    """:returns whether the url belongs to the shard, urls are assigned to shards by a stable hash"""
+
+    return zlib.crc32(url.encode('utf-8')) % shard_count == shard_index
+
 
 class GridBlogSpiderPipeline(object):
+    """Buffers the scraped items and writes them in batches on a dedicated writer thread
+
+    Batches are written one at a time in the order they were buffered, so an article is never written after its
+    author-article relations. When write_queue_size batches are queued and the next one is due, items are held back
+    until a batch is written, which throttles the scraper instead of blocking the reactor. With write_queue_size 0
+    the batches are written on the reactor thread.
+    """
 
-    def __init__(self, db_name, root_url):
-        self.db_controller = DatabaseController(db_name)
+    def __init__(self, db_name, root_url, batch_size, flush_interval, pool_options, staging_db_name=None,
+                 shard_index=0, shard_count=1, body_codec='zstd', write_queue_size=4):
+        self.db_controller = DatabaseController.shared(db_name, **pool_options)
         self.root_url = root_url
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        target = DatabaseController.shared(staging_db_name, **pool_options) if staging_db_name else self.db_controller
+        self.writer = target.buffered_writer(batch_size, flush_interval, body_codec, auto_flush=False)
+        self.write_queue_size = write_queue_size
+        self.writer_thread = ThreadPool(1, 1, name='pipeline-db-writer')
+        self._writes = deque()
+        self._waiting = []
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             db_name=crawler.settings.get('DATABASE_NAME'),
-            root_url=crawler.settings.get('ROOT_URL')
+            root_url=crawler.settings.get('ROOT_URL'),
+            batch_size=crawler.settings.getint('WRITE_BATCH_SIZE'),
+            flush_interval=crawler.settings.getfloat('WRITE_FLUSH_INTERVAL'),
+            pool_options={'pool_size': crawler.settings.getint('DATABASE_POOL_SIZE'),
+                          'max_overflow': crawler.settings.getint('DATABASE_MAX_OVERFLOW'),
+                          'pool_timeout': crawler.settings.getfloat('DATABASE_POOL_TIMEOUT')},
+            staging_db_name=crawler.settings.get('STAGING_DATABASE_NAME'),
+            shard_index=crawler.settings.getint('SHARD_INDEX'),
+            shard_count=crawler.settings.getint('SHARD_COUNT'),
+            body_codec=crawler.settings.get('ARTICLE_BODY_CODEC'),
+            write_queue_size=crawler.settings.getint('WRITE_QUEUE_SIZE')
         )
 
+    def _in_shard(self, urls):
+        return [url for url in urls if in_shard(url, self.shard_index, self.shard_count)]
+
+    def _stale_authors(self, settings):
+        """:returns the shard's part of the AUTHOR_REFRESH_BATCH authors most in need of a refresh"""
+
+        batch = settings.getint('AUTHOR_REFRESH_BATCH')
+        if not batch:
+            return []
+        stale = self.db_controller.get_stale_authors(
+            batch, timedelta(days=settings.getfloat('AUTHOR_REFRESH_MIN_AGE_DAYS')))
+        return [author for author in stale if in_shard(author['url'], self.shard_index, self.shard_count)]
+
     def open_spider(self, spider):
+        if self.write_queue_size:
+            self.writer_thread.start()
         if spider.name == AuthorSpider.name:
-            spider.start_urls = self.db_controller.get_not_scraped_authors()
+            spider.start_urls = self._in_shard(self.db_controller.get_not_scraped_authors())
+            spider.refresh_authors = self._stale_authors(spider.settings)
         elif spider.name == ArticleSpider.name:
             spider.root_url = self.root_url
             spider.start_urls = [self.root_url]
             spider.last_date = self.db_controller.get_last_blog_date()
+            spider.last_date_urls = self.db_controller.get_article_urls_on(spider.last_date)
+            spider.section_states = self.db_controller.get_crawl_states()
+            spider.shard_index = self.shard_index
+            spider.shard_count = self.shard_count
+            spider.fast_parser = spider.settings.getbool('FAST_ARTICLE_PARSER')
+            spider.capture_bodies = spider.settings.getbool('CAPTURE_ARTICLE_BODIES')
+            spider.skip_unchanged = spider.settings.getbool('SKIP_UNCHANGED_ARTICLES')
+            if spider.skip_unchanged:
+                spider.fingerprint_headers = spider.settings.getlist('FINGERPRINT_HEADERS')
+                spider.fingerprints = self.db_controller.get_fingerprints()
+            spider.stream_authors = spider.settings.getbool('STREAM_AUTHORS')
+            if spider.stream_authors:
+                spider.known_authors = self.db_controller.get_author_urls()
+                spider.pending_authors = self._in_shard(self.db_controller.get_not_scraped_authors())
+                spider.refresh_authors = self._stale_authors(spider.settings)
+
+    def close_spider(self, spider):
+        """Writes the remaining rows, the returned Deferred fires when every queued batch is written
+
+        It fails when any batch of the crawl could not be written, as the rows of the batch are lost. Crawl states
+        of the sections the article spider completed go into the last batch.
+        """
+
+        if spider.name == ArticleSpider.name:
+            for state in spider.completed_section_states():
+                self._write(state)
+        self._submit(spider)
+        writes = defer.DeferredList(list(self._writes))
+        writes.addBoth(lambda _: self._closed(spider))
+        return writes
+
+    def _closed(self, spider):
+        if self.writer_thread.started:
+            self.writer_thread.stop()
+        for table, rows in self.writer.rows_written.items():
+            DB_ROWS_WRITTEN.set(rows, spider=spider.name, table=table)
+        spider.logger.info('Database writes: {}'.format(self.writer.stats()))
+        spider.logger.info('Database connections: {}'.format(self.db_controller.connection_stats()))
+        if self.writer.failed_batches:
+            raise RuntimeError('{} batches failed to be written to the database, their rows are lost'.format(
+                self.writer.failed_batches))
 
     def process_item(self, item, spider):
-        if spider.name == AuthorSpider.name:
-            author = Author(**item)
-            self.db_controller.add(author)
-        elif spider.name == ArticleSpider.name:
-            if isinstance(item, ArticleItem):
-                article = Article(**item)
-                self.db_controller.add(article)
-            elif isinstance(item, ArticleAuthorItem):
-                for author_url in item['authors']:
-                    self.db_controller.increment_author_counter_if_exist(author_url)
-                    self.db_controller.add(
-                        AuthorArticleRelation(author_url=author_url, article_url=item['article_url'])
-                    )
+        """Buffers the item, :returns the item or a Deferred firing with it once the full write queue has room"""
 
+        self._write(item)
+        if not self.writer.flush_due():
+            return item
+        if self.write_queue_size and len(self._writes) >= self.write_queue_size:
+            waiting = defer.Deferred()
+            self._waiting.append((waiting, item, time.perf_counter()))
+            return waiting
+        self._submit(spider)
         return item
+
+    def _submit(self, spider):
+        """Hands the buffered rows to the writer thread, or writes them right away without a write queue"""
+
+        batch = self.writer.take()
+        if batch is None:
+            return
+        if not self.write_queue_size:
+            self._write_batch(batch, spider.name)
+            return
+        write = self._defer_write(batch, spider.name)
+        self._writes.append(write)
+        DB_WRITE_QUEUE.set(len(self._writes), spider=spider.name)
+        write.addErrback(lambda failure: spider.logger.error(
+            'Writing a batch to the database failed: {}'.format(failure.getTraceback())))
+        write.addBoth(self._written, spider)
+
+    def _defer_write(self, batch, spider_name):
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.writer_thread, self._write_batch, batch, spider_name)
+
+    def _write_batch(self, batch, spider_name):
+        buffers, _ = batch
+        if self.writer.failed_batches and buffers['states']:
+            # rows of an earlier batch are lost, the sections have to be crawled again from their old watermarks
+            log.warning('Not writing {} section states after a failed batch'.format(
+                len(buffers['states'])))
+            buffers['states'] = []
+        started = time.perf_counter()
+        try:
+            self.writer.write(batch)
+        except Exception:
+            DB_FAILED_BATCHES.inc(spider=spider_name)
+            raise
+        DB_WRITE_LATENCY.observe(time.perf_counter() - started, spider=spider_name, item='batch')
+
+    def _written(self, _, spider):
+        """Removes the written batch from the queue and releases the items waiting for room in it"""
+
+        self._writes.popleft()
+        DB_WRITE_QUEUE.set(len(self._writes), spider=spider.name)
+        if not self._waiting:
+            return
+        # rows of the waiting items are buffered already, they go into the next batch
+        self._submit(spider)
+        waiting, self._waiting = self._waiting, []
+        now = time.perf_counter()
+        for deferred, item, started in waiting:
+            BACKPRESSURE_WAIT.observe(now - started, spider=spider.name)
+            deferred.callback(item)
+
+    def _write(self, item):
+        if isinstance(item, AuthorItem):
+            self.writer.add_author(**item)
+        elif isinstance(item, ArticleItem):
+            self.writer.add_article(**item)
+            self.writer.add_seen_url(item['url'])
+        elif isinstance(item, ArticleAuthorItem):
+            for author_url in item['authors']:
+                self.writer.add_relation(author_url, item['article_url'])
+        elif isinstance(item, AuthorRefreshItem):
+            self.writer.add_author_refresh(**item)
+        elif isinstance(item, SectionStateItem):
+            self.writer.add_section_state(**item)
+        elif isinstance(item, ArticleBodyItem):
+            self.writer.add_body(**item)
+        elif isinstance(item, ContentFingerprintItem):
+            self.writer.add_fingerprint(**item)
@@ -6,6 +6,9 @@ SPIDER_MODULES = ['grid_blog_crawl.spiders']
 NEWSPIDER_MODULE = 'grid_blog_crawl.spiders'
 
 DATABASE_NAME = "database.db"
+DATABASE_POOL_SIZE = 5
+DATABASE_MAX_OVERFLOW = 10
+DATABASE_POOL_TIMEOUT = 30
 
 ROBOTSTXT_OBEY = True
 
@@ -18,3 +21,103 @@ ITEM_PIPELINES = {
    'grid_blog_crawl.pipelines.GridBlogSpiderPipeline': 300,
 }
 
+EXTENSIONS = {
+   'grid_blog_crawl.extensions.MetricsExtension': 500,
+}
+SPIDER_MIDDLEWARES = {
+   'grid_blog_crawl.middlewares.ParseTimingMiddleware': 1000,
+}
+
+# Crawl metrics, written in Prometheus text format to METRICS_FILE at the end of scrape.start()
+METRICS_ENABLED = True
+METRICS_FILE = 'metrics.prom'
+# Seconds between samples of the scheduler and downloader queues
+METRICS_QUEUE_INTERVAL = 1.0
+
+
+# Rows buffered by the pipeline before they are written in one transaction
+WRITE_BATCH_SIZE = 100
+# Seconds after which buffered rows are written even if the batch is not full
+WRITE_FLUSH_INTERVAL = 5.0
+# Batches queued for the writer thread before the pipeline holds items back, 0 writes on the reactor thread
+WRITE_QUEUE_SIZE = 4
+
+# Request author pages as soon as the article spider finds them instead of running the author spider afterwards
+STREAM_AUTHORS = False
+
+# Scraped authors refreshed per crawl, picked by days since they were scraped and by the difference between the
+# article count of their page and the crawled relations. Refreshes are conditional requests, 0 disables them
+AUTHOR_REFRESH_BATCH = 20
+# Authors scraped within this many days are not refreshed
+AUTHOR_REFRESH_MIN_AGE_DAYS = 7
+
+# Extract article pages with precompiled XPath instead of item loaders
+FAST_ARTICLE_PARSER = True
+
+# Skip parsing and writing of article pages whose fingerprint did not change since they were parsed last time,
+# the fingerprint hashes the whitespace normalised page and FINGERPRINT_HEADERS of the response
+SKIP_UNCHANGED_ARTICLES = True
+FINGERPRINT_HEADERS = ['Content-Type', 'Content-Language']
+
+# Store the full text of the article bodies, compressed, next to the 160 character Article.text
+CAPTURE_ARTICLE_BODIES = False
+# zstd (needs the zstandard package, zlib is used when it is not installed) or zlib
+ARTICLE_BODY_CODEC = 'zstd'
+
+# Requests are deduplicated on the canonical url, article pages scraped by earlier crawls are not requested again,
+# unless SKIP_UNCHANGED_ARTICLES revalidates them. Disable to re-request them without revalidation
+DUPEFILTER_CLASS = 'grid_blog_crawl.dupefilters.SeenUrlDupeFilter'
+SEEN_URLS_ENABLED = True
+
+# Named crawl profiles, selected with the CRAWL_PROFILE setting or scrape.start(profile=...)
+_CACHED_CRAWL = {
+    'DNSCACHE_ENABLED': True,
+    'DNSCACHE_SIZE': 1000,
+    'COMPRESSION_ENABLED': True,
+    'HTTPCACHE_ENABLED': True,
+    'HTTPCACHE_DIR': 'httpcache',
+    'HTTPCACHE_GZIP': True,
+    'HTTPCACHE_EXPIRATION_SECS': 0,
+    'HTTPCACHE_POLICY': 'scrapy.extensions.httpcache.RFC2616Policy',
+    'HTTPCACHE_STORAGE': 'scrapy.extensions.httpcache.FilesystemCacheStorage',
+}
+CRAWL_PROFILES = {
+    'polite': dict(
+        _CACHED_CRAWL,
+        CONCURRENT_REQUESTS_PER_DOMAIN=2,
+        DOWNLOAD_DELAY=1.0,
+        AUTOTHROTTLE_ENABLED=True,
+        AUTOTHROTTLE_START_DELAY=1.0,
+        AUTOTHROTTLE_MAX_DELAY=30.0,
+        AUTOTHROTTLE_TARGET_CONCURRENCY=1.0,
+    ),
+    'fast': dict(
+        _CACHED_CRAWL,
+        CONCURRENT_REQUESTS=32,
+        CONCURRENT_REQUESTS_PER_DOMAIN=16,
+        DOWNLOAD_DELAY=0,
+        AUTOTHROTTLE_ENABLED=True,
+        AUTOTHROTTLE_START_DELAY=0.25,
+        AUTOTHROTTLE_MAX_DELAY=5.0,
+        AUTOTHROTTLE_TARGET_CONCURRENCY=8.0,
+    ),
+    # replays the pages cached by earlier crawls, pages missing from the cache are not downloaded
+    'offline-replay': dict(
+        _CACHED_CRAWL,
+        CONCURRENT_REQUESTS=32,
+        CONCURRENT_REQUESTS_PER_DOMAIN=32,
+        DOWNLOAD_DELAY=0,
+        AUTOTHROTTLE_ENABLED=False,
+        HTTPCACHE_POLICY='scrapy.extensions.httpcache.DummyPolicy',
+        HTTPCACHE_IGNORE_MISSING=True,
+    ),
+}
+CRAWL_PROFILE = None
+
+# Number of worker processes scrape.start() splits the blog sections and author pages across
+CRAWL_SHARDS = 1
+# Set by scrape.start() in the worker processes of a sharded crawl: the shard of the worker and the staging
+# database it writes into, the staging databases are merged into DATABASE_NAME when all the workers finished
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+STAGING_DATABASE_NAME = None
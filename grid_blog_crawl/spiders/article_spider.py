@@ -1,6 +1,16 @@
 import scrapy
+from scrapy import signals
 from scrapy.loader import ItemLoader
-from ..items import ArticleItem, ArticleAuthorItem, extract_date
+from ..items import ArticleItem, ArticleAuthorItem, ArticleBodyItem, ContentFingerprintItem, SectionStateItem, \
+    extract_date
+from ..extractors import cards_after, extract_article, extract_body, extract_cards, page_fingerprint
+from ..metrics import REGISTRY
+from ..urls import canonicalize_url
+from .author_spider import author_refresh_requests, parse_author_response
+
+
+ARTICLE_PAGES = REGISTRY.counter('crawl_article_pages_total',
+                                 'Article pages by result: new, revised, unchanged or not_modified (HTTP 304)')
 
 
 class ArticleSpiderOLD(scrapy.Spider):
@@ -53,78 +63,307 @@ class ArticleSpiderOLD(scrapy.Spider):
 
 
 class ArticleSpider(scrapy.Spider):
-    """Spider that scrapes articles from blog.griddynamics"""
+    """Spider that scrapes articles from blog.griddynamics
+
+    The crawl state of a section is kept back until every page and article request of the section succeeded, the
+    pipeline writes the states of the completed sections when the crawl is closed, see completed_section_states().
+    """
 
     name = 'article_spider'
     root_url = ""
     last_date = None
+    last_date_urls = frozenset()
+    section_states = {}
+    fast_parser = False
+    capture_bodies = False
+    skip_unchanged = False
+    fingerprint_headers = ()
+    stream_authors = False
+    known_authors = frozenset()
+    pending_authors = ()
+    refresh_authors = ()
+    shard_index = 0
+    shard_count = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested_authors = set()
+        self.fingerprints = {}
+        self.sections = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        return spider
+
+    def _progress(self, section_url):
+        return self.sections.setdefault(section_url, {'state': None, 'pending': 0, 'failed': False})
+
+    def _track(self, request, section_url):
+        """:returns the request counted as pending for the section, it fails the section when it fails"""
+
+        self._progress(section_url)['pending'] += 1
+        return request.replace(meta=dict(request.meta, section=section_url), errback=self.request_failed)
+
+    def _request_done(self, request):
+        section_url = request.meta.get('section') if request is not None else None
+        if section_url is not None:
+            progress = self._progress(section_url)
+            progress['pending'] = max(progress['pending'] - 1, 0)
+
+    def request_failed(self, failure):
+        """Marks the section of the failed request as failed, so its crawl state is not persisted"""
+
+        request = failure.request
+        self.logger.error('Request {} failed: {}'.format(request.url, failure.getErrorMessage()))
+        section_url = request.meta.get('section')
+        if section_url is not None:
+            self._progress(section_url)['failed'] = True
+        self._request_done(request)
+
+    def request_dropped(self, request, spider):
+        """Requests of articles filtered as duplicates are done, the articles are written or requested already"""
+
+        if spider is self:
+            self._request_done(request)
+
+    def completed_section_states(self):
+        """:returns state items of the sections whose page and article requests all succeeded"""
+
+        return [progress['state'] for progress in self.sections.values()
+                if progress['state'] is not None and not progress['pending'] and not progress['failed']]
+
+    def start_requests(self):
+        """Yields requests for the blog home page and, when streaming authors, for authors not scraped yet and the
+        authors to refresh"""
+
+        yield from super().start_requests()
+        if self.stream_authors:
+            for request in self._gen_author_requests(self.pending_authors):
+                yield request
+            yield from author_refresh_requests(self.refresh_authors, self.parse_author_page)
+
+    def _gen_author_requests(self, author_urls):
+        """Generates requests for author pages that are neither in the database nor requested already"""
+
+        requests = []
+        for url in author_urls:
+            if url in self.known_authors or url in self.requested_authors:
+                continue
+            self.requested_authors.add(url)
+            requests.append(scrapy.Request(url=url, callback=self.parse_author_page))
+        return requests
 
-    def _gen_requests(self, response):
+    def _gen_requests(self, response, watermark, cards_seen):
         """Generates requests for article child page from multi record page"""
 
+        if self.fast_parser:
+            cards = extract_cards(response, self.root_url)
+            cards_seen.extend(cards)
+            return [self._article_request(url) for url in cards_after(cards, watermark)]
         requests = []
-        self._gen_request_regular_cards(response, requests)
-        self._gen_request_featured_cards(response, requests)
+        self._gen_request_regular_cards(response, requests, watermark, cards_seen)
+        self._gen_request_featured_cards(response, requests, watermark, cards_seen)
         return requests
 
     def parse(self, response):
-        """Yields requests for every article multi record page found on blog home page"""
+        """Yields requests for every article multi record page of the shard found on blog home page"""
 
         self.logger.info('Parsing home page {}'.format(response.url))
         article_series = response.css('.card.viewall::attr(href)').extract()
-        for url in article_series:
-            yield scrapy.Request(url=self.root_url+url, callback=self.parse_article_multi_record_page)
+        for url in article_series[self.shard_index::self.shard_count]:
+            section_url = canonicalize_url(url, self.root_url)
+            yield self._track(self._section_request(section_url), section_url)
+
+    def _section_request(self, section_url):
+        """:returns a conditional request for the first page of the section, based on its crawl state"""
+
+        headers = {}
+        state = self.section_states.get(section_url, {})
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return scrapy.Request(url=section_url, headers=headers, callback=self.parse_article_multi_record_page,
+                              meta={'section': section_url, 'handle_httpstatus_list': [304]})
+
+    def _watermark(self, section_url):
+        """:returns the date of the newest article seen in the section and urls of the articles from that date"""
+
+        state = self.section_states.get(section_url)
+        if state is not None and state.get('watermark') is not None:
+            return state['watermark'], frozenset(state['watermark_urls'])
+        return self.last_date, frozenset(self.last_date_urls)
 
     def parse_article_multi_record_page(self, response):
-        """Yields requests for child page of every article found on the article multi record page"""
+        """Yields requests for child page of every new article found on the article multi record page
 
+        Pagination of the section is followed until a page without new articles is found. The crawl state of the
+        section is taken from its first page.
+        """
+
+        section_url = response.meta.get('section', response.url)
+        if response.status == 304:
+            self.logger.info('Section {} has not changed since the last crawl'.format(section_url))
+            self._request_done(response.request)
+            return
         self.logger.info('Parsing multi-record article  page {}'.format(response.url))
-        for request in self._gen_requests(response):
-            yield request
+        watermark = self._watermark(section_url)
+        cards_seen = []
+        requests = self._gen_requests(response, watermark, cards_seen)
+        for request in requests:
+            yield self._track(request, section_url)
+
+        page = response.meta.get('page', 1)
+        if page == 1:
+            self._progress(section_url)['state'] = self._section_state(response, section_url, watermark, cards_seen)
+        next_page = response.css('link[rel=next]::attr(href), a[rel=next]::attr(href)').extract_first()
+        if requests and next_page:
+            yield self._track(scrapy.Request(url=canonicalize_url(response.urljoin(next_page)),
+                                             callback=self.parse_article_multi_record_page,
+                                             meta={'page': page + 1}), section_url)
+        self._request_done(response.request)
+
+    @staticmethod
+    def _section_state(response, section_url, watermark, cards_seen):
+        """:returns item with the crawl state of the section after its first page was parsed"""
+
+        watermark_date, watermark_urls = watermark
+        dates = [pub_date for _, pub_date in cards_seen if pub_date is not None]
+        newest = max(dates + ([watermark_date] if watermark_date is not None else []), default=None)
+        urls = {url for url, pub_date in cards_seen if pub_date == newest}
+        if newest == watermark_date:
+            urls.update(watermark_urls)
+        headers = response.headers
+        return SectionStateItem(
+            section_url=section_url,
+            watermark=newest,
+            watermark_urls=sorted(urls),
+            etag=headers.get('ETag', b'').decode() or None,
+            last_modified=headers.get('Last-Modified', b'').decode() or None,
+        )
+
+    def _changed_fingerprint(self, response):
+        """:returns fingerprint item of the article page if it changed since it was parsed last time, None otherwise"""
+
+        url = canonicalize_url(response.url)
+        known = self.fingerprints.get(url)
+        if response.status == 304:
+            ARTICLE_PAGES.inc(spider=self.name, result='not_modified')
+            return None
+        fingerprint = page_fingerprint(response, self.fingerprint_headers)
+        if known is not None and known['fingerprint'] == fingerprint:
+            ARTICLE_PAGES.inc(spider=self.name, result='unchanged')
+            return None
+        ARTICLE_PAGES.inc(spider=self.name, result='new' if known is None else 'revised')
+        item = ContentFingerprintItem(
+            url=url, fingerprint=fingerprint,
+            etag=response.headers.get('ETag', b'').decode() or None,
+            last_modified=response.headers.get('Last-Modified', b'').decode() or None)
+        self.fingerprints[url] = dict(item)
+        return item
 
     def parse_article_child_page(self, response):
-        """Extracts and yields article item & author-article relation item from article child page"""
+        """Extracts and yields article item & author-article relation item from article child page
+
+        Pages that did not change since they were parsed last time are skipped when skip_unchanged is set.
+        """
+
+        yield from self._parse_article_child_page(response)
+        self._request_done(response.request)
 
+    def _parse_article_child_page(self, response):
+        fingerprint_item = None
+        if self.skip_unchanged:
+            fingerprint_item = self._changed_fingerprint(response)
+            if fingerprint_item is None:
+                self.logger.debug('Article child page {} has not changed'.format(response.url))
+                return
         self.logger.info('Parsing article child page {}'.format(response.url))
+        if self.fast_parser:
+            article_item, article_author_item = extract_article(response, self.root_url)
+        else:
+            article_item, article_author_item = self._load_article_items(response, self.root_url)
+
+        yield article_item
+        yield article_author_item
+        if self.capture_bodies:
+            yield ArticleBodyItem(article_url=article_item['url'], body=extract_body(response))
+        if fingerprint_item is not None:
+            yield fingerprint_item
+        if self.stream_authors:
+            for request in self._gen_author_requests(article_author_item.get('authors', [])):
+                yield request
+
+    @staticmethod
+    def _load_article_items(response, root_url=None):
+        """:returns article item & author-article relation item loaded with item loaders"""
+
         article_loader = ItemLoader(item=ArticleItem(), response=response)
 
-        article_loader.add_value('url', response.url)
+        article_loader.add_value('url', canonicalize_url(response.url))
         article_loader.add_css('title', '#woe #hero h2::text')
         article_loader.add_css('pub_date', '#woe #hero .authwrp .sdate::text')
         article_loader.add_css('text', '#woe .postbody *::text')
         article_loader.add_css('tags', "head meta[property='article:tag'] ::attr(content)")
         article_item = article_loader.load_item()
 
-        article_author_loader = ItemLoader(item=ArticleAuthorItem(), response=response)
+        article_author_loader = ItemLoader(item=ArticleAuthorItem(), response=response, root_url=root_url)
         article_author_loader.add_css('authors', '.goauthor::attr(href)')
         article_author_loader.add_value('article_url', article_item['url'])
         article_author_item = article_author_loader.load_item()
+        return article_item, article_author_item
 
-        yield article_item
-        yield article_author_item
+    def parse_author_page(self, response):
+        """Yields Author item extracted from author child page found while crawling articles"""
 
-    def _gen_req_form_card(self, cards, requests):
+        self.logger.info('parsing author {} page'.format(response.url))
+        yield from parse_author_response(response, self.name)
 
-        """Append request to requests list for child page of every article found in the article cards"""
+    def _gen_req_form_card(self, cards, requests, watermark, cards_seen):
+
+        """Append request to requests list for child page of every article found in the article cards,
+        that is newer than the watermark"""
+        watermark_date, watermark_urls = watermark
         for card in cards:
-            url = card.css('::attr(href)').extract_first()
-            if self.last_date is not None:
+            url = canonicalize_url(card.css('::attr(href)').extract_first(), self.root_url)
+            try:
                 date_formatted = extract_date("".join(card.css('span.name::text').extract()))
-                if self.last_date >= date_formatted:
+            except ValueError:
+                date_formatted = None
+            cards_seen.append((url, date_formatted))
+            if watermark_date is not None and date_formatted is not None:
+                if date_formatted < watermark_date or (date_formatted == watermark_date and url in watermark_urls):
                     continue
-            requests.append(scrapy.Request(url=self.root_url + url, callback=self.parse_article_child_page))
+            requests.append(self._article_request(url))
+
+    def _article_request(self, url):
+        """:returns a request for the article child page, conditional if the page was parsed before
+
+        Articles scraped by earlier crawls are filtered by the dupefilter, unless skip_unchanged revalidates them.
+        """
+
+        headers = {}
+        known = self.fingerprints.get(url) if self.skip_unchanged else None
+        if known is not None:
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+        meta = {'dedupe_across_runs': not self.skip_unchanged}
+        if headers:
+            meta['handle_httpstatus_list'] = [304]
+        return scrapy.Request(url=url, headers=headers, callback=self.parse_article_child_page, meta=meta)
 
-    def _gen_request_regular_cards(self, response, requests):
+    def _gen_request_regular_cards(self, response, requests, watermark, cards_seen):
 
         """Append request to requests list for child page of every regular article found in the response"""
         regular_cards = response.css('a.card.cardtocheck')
-        self._gen_req_form_card(regular_cards, requests)
+        self._gen_req_form_card(regular_cards, requests, watermark, cards_seen)
 
-    def _gen_request_featured_cards(self, response, requests):
+    def _gen_request_featured_cards(self, response, requests, watermark, cards_seen):
 
         """Append request to requests list for child page of every featured article found in the response"""
         featured_cards = response.css('.card.featured')
-        self._gen_req_form_card(featured_cards, requests)
-
-
-
+        self._gen_req_form_card(featured_cards, requests, watermark, cards_seen)
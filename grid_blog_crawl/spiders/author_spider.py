@@ -1,28 +1,70 @@
 import scrapy
 from scrapy.loader import ItemLoader
-from ..items import AuthorItem
+from ..items import AuthorItem, AuthorRefreshItem
+from ..metrics import REGISTRY
+from ..urls import canonicalize_url
+
+AUTHOR_PAGES = REGISTRY.counter('crawl_author_pages_total',
+                                'Author pages by result: new, refreshed or not_modified (HTTP 304)')
+
+
+def load_author_item(response):
+    """:returns Author item extracted from author child page"""
+
+    selector = response.css('.authorcard.popup')
+    author_loader = ItemLoader(item=AuthorItem(), selector=selector)
+
+    author_loader.add_css('name', 'h3::text')
+    author_loader.add_css('job_title', '.jobtitle::text')
+    author_loader.add_css('linkedin_url', '.linkedin::attr(href)')
+    author_loader.add_value('articles_count',
+                            len(selector.css('.postsrow > .row > a::attr(href)')))
+    author_loader.add_value("url", canonicalize_url(response.url))
+
+    return author_loader.load_item()
+
+
+def author_refresh_requests(refresh_authors, callback):
+    """Generates conditional requests for the pages of the scraped authors picked for a refresh"""
+
+    for author in refresh_authors:
+        headers = {}
+        if author.get('etag'):
+            headers['If-None-Match'] = author['etag']
+        if author.get('last_modified'):
+            headers['If-Modified-Since'] = author['last_modified']
+        yield scrapy.Request(url=author['url'], headers=headers, callback=callback,
+                             meta={'refresh': True, 'handle_httpstatus_list': [304]})
+
+
+def parse_author_response(response, spider_name):
+    """Yields Author item of the author page, unless it was not modified, and the time and validators of the scrape"""
+
+    refresh = response.meta.get('refresh', False)
+    if response.status == 304:
+        AUTHOR_PAGES.inc(spider=spider_name, result='not_modified')
+    else:
+        AUTHOR_PAGES.inc(spider=spider_name, result='refreshed' if refresh else 'new')
+        yield load_author_item(response)
+    yield AuthorRefreshItem(author_url=canonicalize_url(response.url),
+                            etag=response.headers.get('ETag', b'').decode() or None,
+                            last_modified=response.headers.get('Last-Modified', b'').decode() or None)
 
 
 class AuthorSpider(scrapy.Spider):
-    """Spider that scrapes author child pages"""
+    """Spider that scrapes author child pages, of the authors not scraped yet and of the stale ones"""
 
     name = "author_spider"
+    refresh_authors = ()
+
+    def start_requests(self):
+        """Yields requests for the authors not scraped yet and conditional requests for the authors to refresh"""
+
+        yield from super().start_requests()
+        yield from author_refresh_requests(self.refresh_authors, self.parse)
 
     def parse(self, response):
         """Yields Author item extracted from author child page"""
 
         self.logger.info('parsing author {} page'.format(response.url))
-        selector = response.css('.authorcard.popup')
-        author_loader = ItemLoader(item=AuthorItem(), selector=selector)
-
-        author_loader.add_css('name', 'h3::text')
-        author_loader.add_css('job_title', '.jobtitle::text')
-        author_loader.add_css('linkedin_url', '.linkedin::attr(href)')
-        author_loader.add_value('articles_count',
-                                len(selector.css('.postsrow > .row > a::attr(href)')))
-        author_loader.add_value("url", response.url)
-
-        item = author_loader.load_item()
-
-        yield item
-
+        yield from parse_author_response(response, self.name)
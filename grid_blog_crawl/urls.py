@@ -0,0 +1,32 @@
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from .settings import ROOT_URL
+
+TRACKING_PARAMETERS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _normalise_path(path):
+    """Blog pages are addressed with a trailing slash, files without it"""
+
+    path = path or '/'
+    last_segment = path.rsplit('/', 1)[-1]
+    if not path.endswith('/') and '.' not in last_segment:
+        return path + '/'
+    return path
+
+
+def canonicalize_url(url, root_url=None):
+    """:returns the canonical form of the blog url, relative urls are resolved against root_url or ROOT_URL
+
+    Scheme and host are lower-cased, the default port, fragment and tracking parameters are dropped, the remaining
+    query parameters are sorted and the trailing slash follows the convention of the blog.
+    """
+
+    parts = urlsplit(urljoin((root_url or ROOT_URL) + '/', url.strip()))
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = '{}:{}'.format(host, parts.port)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not name.lower().startswith('utm_') and name.lower() not in TRACKING_PARAMETERS)
+    return urlunsplit((scheme, host, _normalise_path(parts.path), urlencode(query), ''))
@@ -1,9 +1,23 @@
+import json
 import logging
 import os
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import sqlalchemy as db
-from sqlalchemy import create_engine, desc, distinct, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, desc, distinct, event, func
+from sqlalchemy.orm import deferred, relationship, sessionmaker, undefer
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
+from grid_blog_crawl.urls import canonicalize_url
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 Base = declarative_base()
 
@@ -16,7 +30,8 @@ class Author(Base):
     name = db.Column(db.String(100), nullable=False)
     job_title = db.Column(db.String(100))
     linkedin_url = db.Column(db.String(160))
-    articles_count = db.Column(db.Integer, nullable=False)
+    articles_count = db.Column(db.Integer, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def __repr__(self):
         return "<Author(url = {}, name = {}, job_title = {}, linkedin_url = {}, articles_count = {})>" \
@@ -33,9 +48,12 @@ class Article(Base):
     __tablename__ = "articles"
     url = db.Column(db.String(160), primary_key=True)
     title = db.Column(db.String(160), nullable=False)
-    pub_date = db.Column(db.Date, nullable=False)
+    pub_date = db.Column(db.Date, nullable=False, index=True)
     text = db.Column(db.String(160), nullable=False)
     tags = db.Column(db.String(200))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # full body, only captured with CAPTURE_ARTICLE_BODIES and loaded when accessed
+    body = relationship("ArticleBody", uselist=False, lazy="select")
 
     def __repr__(self):
         return "<Article(title = {}, url = {}, pub_date = {}, text = {}, tags = {})>" \
@@ -51,90 +69,1253 @@ class AuthorArticleRelation(Base):
 
     __tablename__ = "author_article"
     author_url = db.Column(db.String(160), primary_key=True)
-    article_url = db.Column(db.String(160), primary_key=True)
+    article_url = db.Column(db.String(160), primary_key=True, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return "<AuthorArticleRelation(article_url = {}, author_url = {})>" \
             .format(self.article_url, self.author_url)
 
 
+def _upsert_statement(table, update=True):
+    """Builds a SQLite INSERT ... ON CONFLICT statement for the table, keyed on its primary key"""
+
+    columns = [column.name for column in table.columns]
+    keys = [column.name for column in table.primary_key.columns]
+    statement = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) ".format(
+        table.name, ", ".join(columns), ", ".join(":" + column for column in columns), ", ".join(keys))
+    updated = [column for column in columns if column not in keys]
+    if update and updated:
+        statement += "DO UPDATE SET " + ", ".join("{0} = excluded.{0}".format(column) for column in updated)
+    else:
+        statement += "DO NOTHING"
+    return db.text(statement).bindparams(*[db.bindparam(column.name, type_=column.type) for column in table.columns])
+
+
+def _complete_rows(table, rows):
+    """:returns rows with every column of the table present, missing values set to None"""
+
+    return [{column.name: row.get(column.name) for column in table.columns} for row in rows]
+
+
+def _stamped(rows):
+    """:returns rows with updated_at set to the current time, used by the incremental export"""
+
+    now = datetime.utcnow()
+    return [dict(row, updated_at=now) for row in rows]
+
+
+# tables with the updated_at column, added to databases created before it existed
+_TIMESTAMPED = ("authors", "articles", "author_article")
+
+
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", -16000),
+    ("mmap_size", 134217728),
+    ("busy_timeout", 5000),
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applies SQLITE_PRAGMAS to every new connection of the pool"""
+
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute("PRAGMA {} = {}".format(pragma, value))
+    cursor.close()
+
+
+class Tag(Base):
+    """DB model of a tag that articles are labeled with"""
+
+    __tablename__ = "tags"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<Tag(id = {}, name = {})>".format(self.id, self.name)
+
+
+class ArticleTag(Base):
+    """DB model of a relation between article and tag"""
+
+    __tablename__ = "article_tag"
+    article_url = db.Column(db.String(160), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey(Tag.id), primary_key=True, index=True)
+
+    def __repr__(self):
+        return "<ArticleTag(article_url = {}, tag_id = {})>".format(self.article_url, self.tag_id)
+
+
+class CrawlState(Base):
+    """DB model of the incremental crawl state of a blog section"""
+
+    __tablename__ = "crawl_state"
+    section_url = db.Column(db.String(160), primary_key=True)
+    watermark = db.Column(db.Date)
+    watermark_urls = db.Column(db.Text)
+    etag = db.Column(db.String(160))
+    last_modified = db.Column(db.String(64))
+
+    def __repr__(self):
+        return "<CrawlState(section_url = {}, watermark = {}, etag = {}, last_modified = {})>" \
+            .format(self.section_url, self.watermark, self.etag, self.last_modified)
+
+
+BODY_CODECS = ("zstd", "zlib")
+DEFAULT_BODY_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def compress_body(body, codec=DEFAULT_BODY_CODEC):
+    """:returns the utf-8 encoded body compressed with the codec, zlib is used if zstandard is not installed"""
+
+    data = body.encode("utf-8")
+    if codec == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=9).compress(data)
+    if codec not in BODY_CODECS:
+        raise ValueError("Unknown body codec {}, expected one of {}".format(codec, ", ".join(BODY_CODECS)))
+    return "zlib", zlib.compress(data, 9)
+
+
+def decompress_body(codec, data):
+    """:returns the body compressed by compress_body"""
+
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read bodies compressed with zstd")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+class AuthorRefresh(Base):
+    """DB model of when an author page was scraped last and the validators of its response"""
+
+    __tablename__ = "author_refresh"
+    author_url = db.Column(db.String(160), primary_key=True)
+    last_scraped_at = db.Column(db.DateTime, nullable=False, index=True)
+    etag = db.Column(db.String(160))
+    last_modified = db.Column(db.String(64))
+
+    def __repr__(self):
+        return "<AuthorRefresh(author_url = {}, last_scraped_at = {}, etag = {}, last_modified = {})>" \
+            .format(self.author_url, self.last_scraped_at, self.etag, self.last_modified)
+
+
+class ArticleBody(Base):
+    """DB model of the compressed full body of an article"""
+
+    __tablename__ = "article_bodies"
+    article_url = db.Column(db.String(160), db.ForeignKey(Article.url), primary_key=True)
+    codec = db.Column(db.String(8), nullable=False)
+    raw_size = db.Column(db.Integer, nullable=False)
+    compressed_size = db.Column(db.Integer, nullable=False)
+    data = deferred(db.Column(db.LargeBinary, nullable=False))
+
+    @property
+    def text(self):
+        return decompress_body(self.codec, self.data)
+
+    def __repr__(self):
+        return "<ArticleBody(article_url = {}, codec = {}, raw_size = {}, compressed_size = {})>" \
+            .format(self.article_url, self.codec, self.raw_size, self.compressed_size)
+
+
+class ContentFingerprint(Base):
+    """DB model of the fingerprint of the last parsed version of an article page"""
+
+    __tablename__ = "content_fingerprints"
+    url = db.Column(db.String(160), primary_key=True)
+    fingerprint = db.Column(db.String(40), nullable=False)
+    etag = db.Column(db.String(160))
+    last_modified = db.Column(db.String(64))
+    revisions = db.Column(db.Integer, nullable=False, default=0)
+    first_seen_at = db.Column(db.DateTime, nullable=False)
+    revised_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return "<ContentFingerprint(url = {}, fingerprint = {}, revisions = {}, revised_at = {})>" \
+            .format(self.url, self.fingerprint, self.revisions, self.revised_at)
+
+
+class SeenUrl(Base):
+    """DB model of a canonical article url scraped by a crawl, requests for it are filtered by the following crawls"""
+
+    __tablename__ = "seen_urls"
+    url = db.Column(db.String(160), primary_key=True)
+    first_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<SeenUrl(url = {}, first_seen_at = {})>".format(self.url, self.first_seen_at)
+
+
+# revised_at and revisions only change when the fingerprint does, expressions of SET see the values before the update
+_FINGERPRINT_UPSERT = db.text(
+    "INSERT INTO content_fingerprints (url, fingerprint, etag, last_modified, revisions, first_seen_at, revised_at) "
+    "VALUES (:url, :fingerprint, :etag, :last_modified, 0, :now, :now) ON CONFLICT (url) DO UPDATE SET "
+    "revisions = revisions + (fingerprint != excluded.fingerprint), "
+    "revised_at = CASE WHEN fingerprint != excluded.fingerprint THEN excluded.revised_at ELSE revised_at END, "
+    "fingerprint = excluded.fingerprint, etag = excluded.etag, last_modified = excluded.last_modified"
+).bindparams(db.bindparam("now", type_=db.DateTime))
+
+
+NEWEST_ARTICLES_KEPT = 50
+# days of staleness an article of difference between the author page count and the crawled relations weighs
+DRIFT_WEIGHT_DAYS = 7
+
+
+class TagSummary(Base):
+    """Materialized number of articles per tag"""
+
+    __tablename__ = "tag_summary"
+    tag_id = db.Column(db.Integer, db.ForeignKey(Tag.id), primary_key=True)
+    articles_count = db.Column(db.Integer, nullable=False, index=True)
+
+
+class AuthorSummary(Base):
+    """Materialized number of author-article relations per author"""
+
+    __tablename__ = "author_summary"
+    author_url = db.Column(db.String(160), primary_key=True)
+    relations_count = db.Column(db.Integer, nullable=False)
+
+
+class NewestArticle(Base):
+    """Materialized list of the NEWEST_ARTICLES_KEPT newest articles with scraped authors"""
+
+    __tablename__ = "newest_articles"
+    article_url = db.Column(db.String(160), primary_key=True)
+    pub_date = db.Column(db.Date, nullable=False, index=True)
+    authors = db.Column(db.Text, nullable=False)
+
+
+# buckets start on the Monday of the week or on the first day of the month of the publication date
+TREND_PERIODS = ("week", "month")
+_TREND_BUCKET_SQL = {"week": "date(articles.pub_date, 'weekday 0', '-6 days')",
+                     "month": "date(articles.pub_date, 'start of month')"}
+# article urls looked up at a time by the IN queries of the writes
+LOOKUP_CHUNK_SIZE = 500
+
+
+def _check_period(period):
+    if period not in TREND_PERIODS:
+        raise ValueError("Unknown trend period {}, expected one of {}".format(period, ", ".join(TREND_PERIODS)))
+
+
+def bucket_start(day, period):
+    """:returns the first day of the week or month bucket that day falls into"""
+
+    _check_period(period)
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+class TagTrend(Base):
+    """Materialized number of articles per tag and week or month of publication"""
+
+    __tablename__ = "tag_trend"
+    __table_args__ = (db.Index("ix_tag_trend_tag", "tag_id", "period", "bucket"),)
+    period = db.Column(db.String(5), primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey(Tag.id), primary_key=True)
+    articles_count = db.Column(db.Integer, nullable=False)
+
+
+class AuthorTrend(Base):
+    """Materialized number of articles per author and week or month of publication"""
+
+    __tablename__ = "author_trend"
+    __table_args__ = (db.Index("ix_author_trend_author", "author_url", "period", "bucket"),)
+    period = db.Column(db.String(5), primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)
+    author_url = db.Column(db.String(160), primary_key=True)
+    articles_count = db.Column(db.Integer, nullable=False)
+
+
+# per trend table, the column it counts articles by and the table relating it to the articles
+_TRENDS = ((TagTrend, TagTrend.tag_id, ArticleTag.tag_id, ArticleTag.article_url),
+           (AuthorTrend, AuthorTrend.author_url, AuthorArticleRelation.author_url, AuthorArticleRelation.article_url))
+
+
+# authors are concatenated in name order, so the result does not depend on the order the relations were written in
+_NEWEST_ARTICLES_SELECT = """
+    SELECT url, pub_date, group_concat(name, ', ') FROM (
+        SELECT articles.url AS url, articles.pub_date AS pub_date, authors.name AS name
+        FROM articles
+        JOIN author_article ON author_article.article_url = articles.url
+        JOIN authors ON authors.url = author_article.author_url
+        WHERE {}
+        ORDER BY articles.url, authors.name)
+    GROUP BY url"""
+_NEWEST_ARTICLES_UPSERT = "INSERT INTO newest_articles (article_url, pub_date, authors) {} ON CONFLICT (article_url) " \
+                          "DO UPDATE SET pub_date = excluded.pub_date, authors = excluded.authors"
+
+
+# Full-text index over the articles, an external content FTS5 table kept in sync with the articles table by triggers
+_SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE articles_fts USING fts5(title, text, tags, content='articles', content_rowid='rowid')",
+    "CREATE TRIGGER articles_fts_insert AFTER INSERT ON articles BEGIN "
+    "INSERT INTO articles_fts (rowid, title, text, tags) VALUES (new.rowid, new.title, new.text, new.tags); END",
+    "CREATE TRIGGER articles_fts_delete AFTER DELETE ON articles BEGIN "
+    "INSERT INTO articles_fts (articles_fts, rowid, title, text, tags) "
+    "VALUES ('delete', old.rowid, old.title, old.text, old.tags); END",
+    "CREATE TRIGGER articles_fts_update AFTER UPDATE ON articles BEGIN "
+    "INSERT INTO articles_fts (articles_fts, rowid, title, text, tags) "
+    "VALUES ('delete', old.rowid, old.title, old.text, old.tags); "
+    "INSERT INTO articles_fts (rowid, title, text, tags) VALUES (new.rowid, new.title, new.text, new.tags); END",
+)
+# bm25 weights of the title, text and tags columns
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def split_tags(tags):
+    """:returns the list of tags stored in the ':::'-joined Article.tags string"""
+
+    if not tags:
+        return []
+    split = []
+    for tag in tags.split(":::"):
+        tag = tag.strip()
+        if tag and tag not in split:
+            split.append(tag)
+    return split
+
+
 class DatabaseController:
     """Entry point to the database"""
 
     logger = logging.getLogger("Database Controller")
 
-    def __init__(self, _database_name):
-        self.URI = "sqlite:///{0}/{1}".format(os.path.dirname(os.path.abspath(__file__)), _database_name)
-        self.engine = create_engine(self.URI)
-        self.Session = sessionmaker(bind=self.engine)
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, _database_name, pool_size=5, max_overflow=10, pool_timeout=30):
+        self.URI = "sqlite:///{0}".format(os.path.join(os.path.dirname(os.path.abspath(__file__)), _database_name))
+        self.engine = create_engine(self.URI, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout, connect_args={"check_same_thread": False})
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        self.session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        # sessions of the queries handed to the callers, they hold a connection only while a statement runs
+        self._query_sessions = sessionmaker(bind=self.engine, autocommit=True)
+        self._open_sessions = 0
+        self._sessions_lock = threading.Lock()
         Base.metadata.create_all(bind=self.engine)
+        self._migrate()
+
+    def _migrate(self):
+        """Brings databases created by older versions up to date"""
+
+        with self.engine.begin() as connection:
+            inspector = db.inspect(connection)
+            for table in _TIMESTAMPED:
+                if "updated_at" not in {column["name"] for column in inspector.get_columns(table)}:
+                    connection.execute("ALTER TABLE {} ADD COLUMN updated_at DATETIME".format(table))
+            for table in Base.metadata.sorted_tables:
+                existing = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(connection)
+            tags_missing = connection.execute(db.select([ArticleTag.article_url]).limit(1)).first() is None
+            articles_tagged = connection.execute(
+                db.select([Article.url]).where(Article.tags.isnot(None)).limit(1)).first() is not None
+            if tags_missing and articles_tagged:
+                self.logger.info("Backfilling tags table")
+                self._backfill_tags(connection)
+            summaries_missing = any(
+                connection.execute(db.select([summary]).limit(1)).first() is None
+                and connection.execute(base.limit(1)).first() is not None
+                for summary, base in ((TagSummary.tag_id, db.select([ArticleTag.tag_id])),
+                                      (AuthorSummary.author_url, db.select([AuthorArticleRelation.author_url])),
+                                      (TagTrend.tag_id, db.select([ArticleTag.tag_id])),
+                                      (AuthorTrend.author_url, db.select([AuthorArticleRelation.author_url]).where(
+                                          AuthorArticleRelation.article_url.in_(db.select([Article.url]))))))
+            if summaries_missing:
+                self.logger.info("Building report summaries")
+                self.rebuild_summaries(connection)
+            if "articles_fts" not in inspector.get_table_names():
+                self._create_search_index(connection)
+
+    def _create_search_index(self, connection):
+        """Creates the articles_fts full-text index and indexes the existing articles"""
+
+        self.logger.info("Building full-text search index")
+        try:
+            for statement in _SEARCH_INDEX_DDL:
+                connection.execute(statement)
+        except db.exc.OperationalError as e:
+            self.logger.warning("Full-text search is not available, SQLite is built without FTS5: {}".format(e))
+            return
+        connection.execute("INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+
+    def _backfill_tags(self, connection):
+        """Fills tags and article_tag from the ':::'-joined Article.tags column"""
+
+        rows = connection.execute(db.select([Article.url, Article.tags])
+                                  .where(Article.tags.isnot(None)).order_by(db.text("rowid")))
+        while True:
+            chunk = rows.fetchmany(1000)
+            if not chunk:
+                break
+            self._write_article_tags(connection, [{"url": url, "tags": tags} for url, tags in chunk])
+
+    def _tag_ids(self, connection, names):
+        """:returns ids of the tags with the given names, creating the missing ones"""
+
+        if not names:
+            return {}
+        connection.execute(db.text("INSERT INTO tags (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                           [{"name": name} for name in names])
+        return dict(connection.execute(db.select([Tag.name, Tag.id]).where(Tag.name.in_(names))).fetchall())
+
+    def _write_article_tags(self, connection, articles):
+        """Synchronises article_tag with the tags of the given article rows"""
+
+        for article in articles:
+            tags = split_tags(article.get("tags"))
+            tag_ids = self._tag_ids(connection, tags)
+            wanted = [tag_ids[tag] for tag in tags]
+            existing = {tag_id for tag_id, in connection.execute(
+                db.select([ArticleTag.tag_id]).where(ArticleTag.article_url == article["url"]))}
+            removed = existing.difference(wanted)
+            added = [tag_id for tag_id in wanted if tag_id not in existing]
+            if removed:
+                connection.execute(ArticleTag.__table__.delete().where(db.and_(
+                    ArticleTag.article_url == article["url"], ArticleTag.tag_id.in_(removed))))
+                self._count_tags(connection, removed, -1)
+            if added:
+                connection.execute(ArticleTag.__table__.insert(),
+                                   [{"article_url": article["url"], "tag_id": tag_id} for tag_id in added])
+                self._count_tags(connection, added, 1)
+
+    @staticmethod
+    def _count_tags(connection, tag_ids, delta):
+        """Adds delta to the number of articles of the tags in tag_summary"""
+
+        connection.execute(db.text("INSERT INTO tag_summary (tag_id, articles_count) VALUES (:tag_id, :delta) "
+                                   "ON CONFLICT (tag_id) DO UPDATE SET articles_count = articles_count + :delta"),
+                           [{"tag_id": tag_id, "delta": delta} for tag_id in tag_ids])
+
+    @staticmethod
+    def _count_relations(connection, author_urls):
+        """Adds one to the number of relations in author_summary for every occurrence of the author url"""
+
+        connection.execute(db.text("INSERT INTO author_summary (author_url, relations_count) VALUES (:author, 1) "
+                                   "ON CONFLICT (author_url) DO UPDATE SET relations_count = relations_count + 1"),
+                           [{"author": author_url} for author_url in author_urls])
+
+    @staticmethod
+    def _existing_relations(connection, article_urls):
+        """:returns set of the (author url, article url) relations of the given articles"""
+
+        urls, relations = sorted(set(article_urls)), set()
+        for start in range(0, len(urls), LOOKUP_CHUNK_SIZE):
+            chunk = urls[start:start + LOOKUP_CHUNK_SIZE]
+            relations.update((author_url, article_url) for author_url, article_url in connection.execute(
+                db.select([AuthorArticleRelation.author_url, AuthorArticleRelation.article_url])
+                .where(AuthorArticleRelation.article_url.in_(chunk))))
+        return relations
+
+    @staticmethod
+    def _pub_dates(connection, article_urls):
+        """:returns dict of url to publication date of the given articles that exist"""
+
+        urls, pub_dates = sorted(set(article_urls)), {}
+        for start in range(0, len(urls), LOOKUP_CHUNK_SIZE):
+            chunk = urls[start:start + LOOKUP_CHUNK_SIZE]
+            pub_dates.update(connection.execute(db.select([Article.url, Article.pub_date])
+                                                .where(Article.url.in_(chunk))).fetchall())
+        return pub_dates
+
+    @staticmethod
+    def _trend_contributions(connection, article_urls):
+        """:returns Counter of (trend model, key, period, bucket) to the number of the given articles counted in it"""
+
+        contributions = Counter()
+        urls = sorted(set(article_urls))
+        for start in range(0, len(urls), LOOKUP_CHUNK_SIZE):
+            chunk = urls[start:start + LOOKUP_CHUNK_SIZE]
+            for model, _, key, article_url in _TRENDS:
+                rows = connection.execute(db.select([key, Article.pub_date])
+                                          .select_from(key.table.join(Article, Article.url == article_url))
+                                          .where(article_url.in_(chunk)))
+                for value, pub_date in rows:
+                    for period in TREND_PERIODS:
+                        contributions[model, value, period, bucket_start(pub_date, period)] += 1
+        return contributions
+
+    @staticmethod
+    def _count_trends(connection, before, after):
+        """Applies the difference between the trend contributions of articles before and after they were written"""
+
+        delta = Counter(after)
+        delta.subtract(before)
+        for model, column, _, _ in _TRENDS:
+            rows = [{"key": value, "period": period, "bucket": bucket, "delta": count}
+                    for (trend, value, period, bucket), count in delta.items() if trend is model and count]
+            if rows:
+                connection.execute(db.text(
+                    "INSERT INTO {table} (period, bucket, {key}, articles_count) "
+                    "VALUES (:period, :bucket, :key, :delta) "
+                    "ON CONFLICT (period, bucket, {key}) DO UPDATE SET articles_count = articles_count + :delta"
+                    .format(table=model.__tablename__, key=column.name)).bindparams(
+                    db.bindparam("bucket", type_=db.Date)), rows)
+
+    @staticmethod
+    def _refresh_newest_articles(connection, article_urls=(), author_urls=()):
+        """Updates newest_articles with the given articles or the articles of the given authors
+
+        Rows of the given articles are replaced, so an article whose pub_date moved below the kept ones leaves the
+        list, which is then filled up from the articles table.
+        """
+
+        count = db.select([func.count()]).select_from(NewestArticle.__table__)
+        kept = connection.execute(count).scalar()
+        floor = connection.execute(db.select([NewestArticle.pub_date]).order_by(desc(NewestArticle.pub_date))
+                                   .limit(1).offset(NEWEST_ARTICLES_KEPT - 1)).scalar()
+        condition = "(:floor IS NULL OR articles.pub_date >= :floor) AND articles.url IN {}"
+        for urls, selection in ((article_urls, ":urls"),
+                                (author_urls, "(SELECT article_url FROM author_article WHERE author_url IN :urls)")):
+            if not urls:
+                continue
+            connection.execute(db.text("DELETE FROM newest_articles WHERE article_url IN {}".format(selection))
+                               .bindparams(db.bindparam("urls", expanding=True)), urls=list(set(urls)))
+            select = _NEWEST_ARTICLES_SELECT.format(condition.format(selection))
+            connection.execute(db.text(_NEWEST_ARTICLES_UPSERT.format(select)).bindparams(
+                db.bindparam("urls", expanding=True), db.bindparam("floor", type_=db.Date)),
+                urls=list(set(urls)), floor=floor)
+        if connection.execute(count).scalar() < kept:
+            select = _NEWEST_ARTICLES_SELECT.format("1") + " ORDER BY pub_date DESC, url LIMIT :kept"
+            connection.execute(db.text("INSERT OR IGNORE INTO newest_articles (article_url, pub_date, authors) "
+                                       + select), kept=NEWEST_ARTICLES_KEPT)
+        connection.execute(db.text(
+            "DELETE FROM newest_articles WHERE article_url NOT IN (SELECT article_url FROM newest_articles "
+            "ORDER BY pub_date DESC, article_url LIMIT :kept)"), kept=NEWEST_ARTICLES_KEPT)
+
+    def rebuild_summaries(self, connection=None):
+        """Recomputes tag_summary, author_summary, newest_articles and the trend buckets from the base tables"""
+
+        def rebuild(conn):
+            for summary in (TagSummary, AuthorSummary, NewestArticle):
+                conn.execute(summary.__table__.delete())
+            conn.execute("INSERT INTO tag_summary (tag_id, articles_count) "
+                         "SELECT tag_id, count(*) FROM article_tag GROUP BY tag_id")
+            conn.execute("INSERT INTO author_summary (author_url, relations_count) "
+                         "SELECT author_url, count(*) FROM author_article GROUP BY author_url")
+            select = _NEWEST_ARTICLES_SELECT.format("1") + " ORDER BY pub_date DESC, url LIMIT :kept"
+            conn.execute(db.text("INSERT INTO newest_articles (article_url, pub_date, authors) " + select),
+                         kept=NEWEST_ARTICLES_KEPT)
+            for model, column, key, article_url in _TRENDS:
+                conn.execute(model.__table__.delete())
+                for period, bucket in _TREND_BUCKET_SQL.items():
+                    conn.execute(db.text(
+                        "INSERT INTO {table} (period, bucket, {column}, articles_count) "
+                        "SELECT :period, {bucket}, {base}.{key}, count(*) FROM {base} "
+                        "JOIN articles ON articles.url = {base}.{article_url} GROUP BY 2, 3".format(
+                            table=model.__tablename__, column=column.name, bucket=bucket, key=key.name,
+                            base=key.table.name, article_url=article_url.name)), period=period)
+
+        self._in_transaction(connection, rebuild)
+
+    @classmethod
+    def shared(cls, _database_name, **pool_options):
+        """:returns the controller of the database shared by every caller in this process"""
+
+        with cls._shared_lock:
+            if _database_name not in cls._shared:
+                cls._shared[_database_name] = cls(_database_name, **pool_options)
+            return cls._shared[_database_name]
 
     def get_session(self):
-        """:return a database session"""
-        return self.Session()
+        """:return a new database session, it has to be closed by the caller"""
+        return self.session_factory()
+
+    @contextmanager
+    def session_scope(self):
+        """Provides a session that is committed on success, rolled back on error and always closed"""
+
+        session = self.session_factory()
+        with self._sessions_lock:
+            self._open_sessions += 1
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+            with self._sessions_lock:
+                self._open_sessions -= 1
+
+    def connection_stats(self):
+        """:returns the number of open sessions and the state of the connection pool"""
+
+        pool = self.engine.pool
+        return {"open_sessions": self._open_sessions, "pool_size": pool.size(),
+                "checked_out": pool.checkedout(), "checked_in": pool.checkedin(), "overflow": pool.overflow()}
+
+    def dispose(self):
+        """Closes every pooled connection"""
+
+        self.engine.dispose()
 
     def get_not_scraped_authors(self):
-        """:returns a list of authors that are not scraped"""
+        """:returns a sorted list of canonical urls of the authors that are not scraped"""
 
         self.logger.info("Fetching not scraped authors from database")
-        session = self.get_session()
-        db_authors = session.query(distinct(AuthorArticleRelation.author_url))\
-            .filter(~AuthorArticleRelation.author_url.in_(session.query(Author.url)))
-        return list(map(lambda x: x[0], db_authors))
+        with self.session_scope() as session:
+            db_authors = session.query(distinct(AuthorArticleRelation.author_url))\
+                .filter(~AuthorArticleRelation.author_url.in_(session.query(Author.url)))
+            # urls written before they were canonicalized may differ from the scraped author urls only in form
+            return sorted({canonicalize_url(url) for url, in db_authors} - self.get_author_urls())
+
+    def get_article_urls_on(self, pub_date):
+        """:returns a set with urls of the articles published on the given date"""
+
+        with self.session_scope() as session:
+            return {url for url, in session.query(Article.url).filter(Article.pub_date == pub_date)}
+
+    def get_crawl_states(self):
+        """:returns a dict of section url to its crawl state"""
+
+        with self.session_scope() as session:
+            return {state.section_url: {"watermark": state.watermark,
+                                        "watermark_urls": json.loads(state.watermark_urls or "[]"),
+                                        "etag": state.etag, "last_modified": state.last_modified}
+                    for state in session.query(CrawlState)}
+
+    def upsert_crawl_states(self, rows, connection=None):
+        """Inserts crawl states of sections, replacing the existing ones"""
+
+        table = CrawlState.__table__
+        rows = _complete_rows(table, [dict(row, watermark_urls=json.dumps(list(row.get("watermark_urls", []))))
+                                      for row in rows])
+        if rows:
+            self._in_transaction(connection, lambda conn: conn.execute(_upsert_statement(table), rows))
+        return len(rows)
+
+    def get_author_urls(self):
+        """:returns a set with canonical urls of all the scraped authors"""
+
+        with self.session_scope() as session:
+            return {canonicalize_url(url) for url, in session.query(Author.url)}
+
+    def get_seen_urls(self):
+        """:returns a frozenset with the canonical urls scraped by the earlier crawls"""
+
+        with self.session_scope() as session:
+            return frozenset(url for url, in session.query(SeenUrl.url))
+
+    def upsert_seen_urls(self, urls, connection=None):
+        """Inserts the urls that were not seen yet, keeping when they were seen first"""
+
+        now = datetime.utcnow()
+        rows = [{"url": url, "first_seen_at": now} for url in urls]
+        if rows:
+            self._in_transaction(connection, lambda conn: conn.execute(
+                _upsert_statement(SeenUrl.__table__, update=False), rows))
+        return len(rows)
 
     def increment_author_counter_if_exist(self, author_url):
         """increments author article counter if the author exists"""
 
-        session = self.get_session()
-        author = session.query(Author).filter(Author.url == author_url).first()
-        if author is not None:
-            author.articles_count += 1
-            session.commit()
+        with self.session_scope() as session:
+            author = session.query(Author).filter(Author.url == author_url).first()
+            if author is not None:
+                author.articles_count += 1
+
+    def get_stale_authors(self, limit, min_age=timedelta(days=7), drift_weight=DRIFT_WEIGHT_DAYS):
+        """:returns up to limit dicts with url, etag and last_modified of the scraped authors to refresh, most urgent
+        first
+
+        Authors scraped within min_age are not refreshed. The others are ranked by days since they were scraped plus
+        drift_weight days per article the author page count differs from the crawled author-article relations.
+        Authors never refreshed, scraped before the refresh times were kept, come first.
+        """
+
+        now = datetime.utcnow()
+        age = func.julianday(now) - func.julianday(AuthorRefresh.last_scraped_at)
+        drift = func.abs(Author.articles_count - func.coalesce(AuthorSummary.relations_count, 0))
+        with self.session_scope() as session:
+            stale = session.query(Author.url, AuthorRefresh.etag, AuthorRefresh.last_modified)\
+                .outerjoin(AuthorRefresh, AuthorRefresh.author_url == Author.url)\
+                .outerjoin(AuthorSummary, AuthorSummary.author_url == Author.url)\
+                .filter(db.or_(AuthorRefresh.last_scraped_at.is_(None),
+                               AuthorRefresh.last_scraped_at <= now - min_age))\
+                .order_by(AuthorRefresh.last_scraped_at.isnot(None), desc(age + drift_weight * drift), Author.url)\
+                .limit(limit)
+            return [{"url": url, "etag": etag, "last_modified": last_modified} for url, etag, last_modified in stale]
+
+    def upsert_author_refreshes(self, rows, connection=None):
+        """Records that the author pages were scraped, rows without last_scraped_at are stamped with the current time
+
+        :param rows: dicts with author_url and the etag and last_modified of the response
+        """
+
+        now = datetime.utcnow()
+        table = AuthorRefresh.__table__
+        rows = _complete_rows(table, [dict(row, last_scraped_at=row.get("last_scraped_at") or now) for row in rows])
+        if rows:
+            self._in_transaction(connection, lambda conn: conn.execute(_upsert_statement(table), rows))
+        return len(rows)
 
     def compare_article_counts(self):
         """:returns a table with comparison of author article count between author page and blog pages information"""
 
-        session = self.get_session()
-        grouped = session.query(AuthorArticleRelation.author_url, Author.articles_count,
-                                func.count(AuthorArticleRelation.article_url))\
-            .group_by(AuthorArticleRelation.author_url).join(Author, AuthorArticleRelation.author_url == Author.url)
-        return grouped
+        with self.session_scope() as session:
+            return session.query(AuthorArticleRelation.author_url, Author.articles_count,
+                                 func.count(AuthorArticleRelation.article_url))\
+                .group_by(AuthorArticleRelation.author_url)\
+                .join(Author, AuthorArticleRelation.author_url == Author.url).all()
+
+    def get_tag_counts(self, limit=None):
+        """:returns (tag, number of articles) pairs, most popular tags first"""
+
+        with self.session_scope() as session:
+            query = session.query(Tag.name, TagSummary.articles_count).join(TagSummary, TagSummary.tag_id == Tag.id)\
+                .filter(TagSummary.articles_count > 0).order_by(desc(TagSummary.articles_count), Tag.id)
+            if limit is not None:
+                query = query.limit(limit)
+            return query.all()
+
+    def get_newest_articles(self, limit):
+        """:returns (url, title, pub_date, tags, authors) of the newest articles that have authors, newest first"""
+
+        if limit > NEWEST_ARTICLES_KEPT:
+            with self.engine.connect() as connection:
+                select = _NEWEST_ARTICLES_SELECT.format("1") + " ORDER BY pub_date DESC, url LIMIT :limit"
+                newest = connection.execute(db.text(select), limit=limit).fetchall()
+            urls = [url for url, _, _ in newest]
+            with self.session_scope() as session:
+                articles = {article.url: article for article in session.query(Article).filter(Article.url.in_(urls))}
+            return [(url, articles[url].title, articles[url].pub_date,
+                     articles[url].tags.replace(":::", ", ") if articles[url].tags is not None else None, authors)
+                    for url, _, authors in newest]
+        with self.session_scope() as session:
+            return session.query(Article.url, Article.title, Article.pub_date,
+                                 func.replace(Article.tags, ":::", ", "), NewestArticle.authors)\
+                .join(NewestArticle, NewestArticle.article_url == Article.url)\
+                .order_by(desc(NewestArticle.pub_date), NewestArticle.article_url).limit(limit).all()
+
+    def get_top_authors(self, limit):
+        """:returns (name, articles_count, relation count) of the authors with most articles"""
+
+        with self.session_scope() as session:
+            return session.query(Author.name, Author.articles_count, AuthorSummary.relations_count)\
+                .join(AuthorSummary, AuthorSummary.author_url == Author.url)\
+                .filter(AuthorSummary.relations_count > 0)\
+                .order_by(desc(Author.articles_count), Author.name).limit(limit).all()
+
+    def get_trend(self, period, tag=None, author_url=None, since=None, until=None):
+        """:returns (bucket, articles_count) of the tag or the author with buckets between since and until, oldest first
+
+        Only the non-empty buckets are returned, the bucket of a date is bucket_start(date, period).
+        """
+
+        _check_period(period)
+        if (tag is None) == (author_url is None):
+            raise ValueError("Trend of exactly one of tag and author_url can be read")
+        with self.session_scope() as session:
+            if tag is not None:
+                query = session.query(TagTrend.bucket, TagTrend.articles_count)\
+                    .join(Tag, Tag.id == TagTrend.tag_id).filter(Tag.name == tag)
+                model = TagTrend
+            else:
+                query = session.query(AuthorTrend.bucket, AuthorTrend.articles_count)\
+                    .filter(AuthorTrend.author_url == author_url)
+                model = AuthorTrend
+            query = query.filter(model.period == period, model.articles_count > 0)
+            if since is not None:
+                query = query.filter(model.bucket >= since)
+            if until is not None:
+                query = query.filter(model.bucket <= until)
+            return query.order_by(model.bucket).all()
+
+    def get_tag_trends(self, period, since, until):
+        """:returns (tag, bucket, articles_count) of the non-empty tag buckets between since and until"""
+
+        _check_period(period)
+        with self.session_scope() as session:
+            return session.query(Tag.name, TagTrend.bucket, TagTrend.articles_count)\
+                .join(Tag, Tag.id == TagTrend.tag_id)\
+                .filter(TagTrend.period == period, TagTrend.bucket >= since, TagTrend.bucket <= until,
+                        TagTrend.articles_count > 0).all()
+
+    def get_last_trend_bucket(self, period):
+        """:returns the newest bucket with tagged articles or None"""
+
+        _check_period(period)
+        with self.session_scope() as session:
+            return session.query(func.max(TagTrend.bucket))\
+                .filter(TagTrend.period == period, TagTrend.articles_count > 0).scalar()
+
+    def search(self, query, limit=10, tag=None, since=None):
+        """Searches the title, text and tags of the articles
+
+        :param query: FTS5 query, e.g. 'semantic search' or '"product discovery" OR autocomplete'
+        :param tag: only articles labeled with the tag are returned when given
+        :param since: only articles published on or after the date are returned when given
+        :returns (url, title, pub_date, snippet, rank) of the best matching articles, best first
+        """
+
+        conditions = ["articles_fts MATCH :query"]
+        params = {"query": query, "limit": limit}
+        if tag is not None:
+            conditions.append("articles.url IN (SELECT article_tag.article_url FROM article_tag "
+                              "JOIN tags ON tags.id = article_tag.tag_id WHERE tags.name = :tag)")
+            params["tag"] = tag
+        if since is not None:
+            conditions.append("articles.pub_date >= :since")
+            params["since"] = since.isoformat()
+        statement = db.text(
+            "SELECT articles.url, articles.title, articles.pub_date, "
+            "snippet(articles_fts, -1, '[', ']', '...', 16) AS snippet, bm25(articles_fts, {}) AS rank "
+            "FROM articles_fts JOIN articles ON articles.rowid = articles_fts.rowid "
+            "WHERE {} ORDER BY rank LIMIT :limit".format(", ".join(map(str, SEARCH_WEIGHTS)), " AND ".join(conditions))
+        ).columns(pub_date=db.Date)
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(statement, **params).fetchall()
+        except db.exc.OperationalError as e:
+            raise ValueError("Can not search for {!r}: {}".format(query, e.orig))
+
+    def get_article_body(self, article_url):
+        """:returns the full body of the article or None if it was not captured"""
+
+        with self.session_scope() as session:
+            body = session.query(ArticleBody).filter(ArticleBody.article_url == article_url)\
+                .options(undefer(ArticleBody.data)).first()
+            return body.text if body is not None else None
+
+    def get_body_stats(self):
+        """:returns number of captured bodies, their raw and compressed bytes and compression ratio per codec"""
+
+        with self.session_scope() as session:
+            rows = session.query(ArticleBody.codec, func.count(), func.sum(ArticleBody.raw_size),
+                                 func.sum(ArticleBody.compressed_size)).group_by(ArticleBody.codec).all()
+        return {codec: {"bodies": count, "raw_bytes": raw, "compressed_bytes": compressed,
+                        "raw_bytes_per_article": round(raw / count, 1),
+                        "compressed_bytes_per_article": round(compressed / count, 1),
+                        "compression_ratio": round(raw / compressed, 2) if compressed else None}
+                for codec, count, raw, compressed in rows}
+
+    def stream_rows(self, model, since=None, chunk_size=1000, order_by=()):
+        """Yields the rows of the model's table as dicts, fetching chunk_size rows at a time
+
+        :param since: only rows updated after the datetime are yielded when given
+        """
+
+        columns = list(model.__table__.columns)
+        with self.session_scope() as session:
+            query = session.query(*columns)
+            if since is not None:
+                query = query.filter(model.updated_at > since)
+            for row in query.order_by(*order_by).yield_per(chunk_size):
+                yield dict(zip((column.name for column in columns), row))
+
+    def get_article_tags(self, article_url):
+        """:returns the tags of the article with the given url"""
+
+        with self.session_scope() as session:
+            return [name for name, in session.query(Tag.name).join(ArticleTag, ArticleTag.tag_id == Tag.id)
+                    .filter(ArticleTag.article_url == article_url).order_by(Tag.id)]
 
     def get_author(self, author_url):
         """:return an author with the given url"""
 
-        return self.get_session().query(Author).filter(Author.url == author_url).first()
+        with self.session_scope() as session:
+            return session.query(Author).filter(Author.url == author_url).first()
 
     def get_articles(self):
-        """:returns all articles"""
+        """:returns query of all articles"""
 
-        session = self.get_session()
-        return session.query(Article)
+        return self._query_sessions().query(Article)
 
     def get_article_author(self):
-        """:returns all author article relations """
+        """:returns query of all author article relations """
 
-        session = self.get_session()
-        return session.query(AuthorArticleRelation)
+        return self._query_sessions().query(AuthorArticleRelation)
 
     def get_authors(self):
-        """:returns all authors"""
+        """:returns query of all authors"""
 
-        session = self.get_session()
-        return session.query(Author)
+        return self._query_sessions().query(Author)
 
     def add(self, *args):
         """Inserts into db"""
 
-        session = self.get_session()
-        for model in args:
-            session.add(model)
-        session.commit()
+        with self.session_scope() as session:
+            for model in args:
+                session.add(model)
+
+    def _in_transaction(self, connection, write):
+        if connection is not None:
+            return write(connection)
+        with self.engine.begin() as connection:
+            return write(connection)
+
+    def upsert_authors(self, rows, connection=None):
+        """Inserts authors, updating the ones that already exist"""
+
+        table = Author.__table__
+        rows = _complete_rows(table, _stamped(rows))
+
+        def write(conn):
+            conn.execute(_upsert_statement(table), rows)
+            self._refresh_newest_articles(conn, author_urls=[row["url"] for row in rows])
+
+        if rows:
+            self._in_transaction(connection, write)
+        return len(rows)
+
+    def upsert_articles(self, rows, connection=None):
+        """Inserts articles, updating the ones that already exist"""
+
+        table = Article.__table__
+        rows = _complete_rows(table, _stamped(rows))
+
+        def write(conn):
+            urls = [row["url"] for row in rows]
+            trends = self._trend_contributions(conn, urls)
+            conn.execute(_upsert_statement(table), rows)
+            self._write_article_tags(conn, rows)
+            self._count_trends(conn, trends, self._trend_contributions(conn, urls))
+            self._refresh_newest_articles(conn, article_urls=urls)
+
+        if rows:
+            self._in_transaction(connection, write)
+        return len(rows)
+
+    def upsert_bodies(self, rows, connection=None, codec=DEFAULT_BODY_CODEC):
+        """Compresses and inserts full bodies of articles, replacing the existing ones
+
+        :param rows: dicts with article_url and body
+        :returns dict with the number of bodies, their raw and compressed bytes
+        """
+
+        table = ArticleBody.__table__
+        compressed = []
+        for row in rows:
+            raw = row["body"].encode("utf-8")
+            row_codec, data = compress_body(row["body"], codec)
+            compressed.append({"article_url": row["article_url"], "codec": row_codec, "raw_size": len(raw),
+                               "compressed_size": len(data), "data": data})
+        if compressed:
+            self._in_transaction(connection, lambda conn: conn.execute(_upsert_statement(table), compressed))
+        return {"bodies": len(compressed), "raw_bytes": sum(row["raw_size"] for row in compressed),
+                "compressed_bytes": sum(row["compressed_size"] for row in compressed)}
+
+    def get_fingerprints(self):
+        """:returns a dict of article url to the fingerprint, etag and last_modified of its last parsed page"""
+
+        with self.session_scope() as session:
+            return {url: {"fingerprint": fingerprint, "etag": etag, "last_modified": last_modified}
+                    for url, fingerprint, etag, last_modified in session.query(
+                        ContentFingerprint.url, ContentFingerprint.fingerprint, ContentFingerprint.etag,
+                        ContentFingerprint.last_modified)}
+
+    def upsert_fingerprints(self, rows, connection=None):
+        """Inserts fingerprints of parsed pages, a changed fingerprint counts as a revision of the page"""
+
+        now = datetime.utcnow()
+        rows = [dict(_complete_rows(ContentFingerprint.__table__, [row])[0], now=now) for row in rows]
+        if rows:
+            self._in_transaction(connection, lambda conn: conn.execute(_FINGERPRINT_UPSERT, rows))
+        return len(rows)
+
+    def upsert_relations(self, rows, connection=None, fresh_authors=frozenset()):
+        """Inserts author-article relations that do not exist yet and increments the counter of their authors
+
+        Authors in fresh_authors were scraped after the relation was published, their counter already includes it.
+        :returns the relations that were new
+        """
+
+        statement = _upsert_statement(AuthorArticleRelation.__table__, update=False)
+        increment = Author.__table__.update().where(Author.url == db.bindparam("author"))\
+            .values(articles_count=Author.articles_count + 1, updated_at=db.bindparam("now"))
+
+        def write(conn):
+            seen = self._existing_relations(conn, [row["article_url"] for row in rows])
+            new_relations = []
+            for row in _complete_rows(AuthorArticleRelation.__table__, _stamped(rows)):
+                if (row["author_url"], row["article_url"]) not in seen:
+                    seen.add((row["author_url"], row["article_url"]))
+                    new_relations.append(row)
+            if new_relations:
+                conn.execute(statement, new_relations)
+            outdated = [{"author": row["author_url"], "now": row["updated_at"]} for row in new_relations
+                        if row["author_url"] not in fresh_authors]
+            if outdated:
+                conn.execute(increment, outdated)
+            if new_relations:
+                self._count_relations(conn, [row["author_url"] for row in new_relations])
+                pub_dates = self._pub_dates(conn, [row["article_url"] for row in new_relations])
+                self._count_trends(conn, Counter(), Counter(
+                    (AuthorTrend, row["author_url"], period, bucket_start(pub_dates[row["article_url"]], period))
+                    for row in new_relations if row["article_url"] in pub_dates for period in TREND_PERIODS))
+                self._refresh_newest_articles(conn, article_urls=[row["article_url"] for row in new_relations])
+            return new_relations
+
+        return self._in_transaction(connection, write)
+
+    def upsert(self, *args):
+        """Inserts into db, updating models that already exist"""
+
+        upserts = {Author: self.upsert_authors, Article: self.upsert_articles,
+                   AuthorArticleRelation: self.upsert_relations}
+        with self.engine.begin() as connection:
+            for model in args:
+                row = {column.name: getattr(model, column.name) for column in model.__table__.columns}
+                upserts[type(model)]([row], connection)
+
+    def merge(self, staging):
+        """Writes the crawl rows of the staging database into this one inside one transaction
+
+        Authors of the staging database were scraped after their relations were published, so their counters are
+        not incremented for the merged relations, the same as the buffered writer does.
+        :returns dict of table name to number of merged rows
+        """
+
+        with staging.engine.connect() as source:
+            def read(model, *order_by):
+                return [dict(row) for row in source.execute(model.__table__.select().order_by(*order_by))]
+
+            authors = read(Author, Author.url)
+            articles = read(Article, Article.pub_date, Article.url)
+            relations = read(AuthorArticleRelation, AuthorArticleRelation.article_url, AuthorArticleRelation.author_url)
+            states = [dict(state, watermark_urls=json.loads(state["watermark_urls"] or "[]"))
+                      for state in read(CrawlState, CrawlState.section_url)]
+            bodies = read(ArticleBody, ArticleBody.article_url)
+            fingerprints = read(ContentFingerprint, ContentFingerprint.url)
+            seen_urls = read(SeenUrl, SeenUrl.url)
+            refreshes = read(AuthorRefresh, AuthorRefresh.author_url)
+        with self.engine.begin() as connection:
+            self.upsert_authors(authors, connection)
+            self.upsert_articles(articles, connection)
+            self.upsert_relations(relations, connection, fresh_authors={author["url"] for author in authors})
+            self.upsert_crawl_states(states, connection)
+            if bodies:
+                # already compressed, copied as they are
+                connection.execute(_upsert_statement(ArticleBody.__table__), bodies)
+            self.upsert_fingerprints(fingerprints, connection)
+            if seen_urls:
+                connection.execute(_upsert_statement(SeenUrl.__table__, update=False), seen_urls)
+            self.upsert_author_refreshes(refreshes, connection)
+        return {Author.__tablename__: len(authors), Article.__tablename__: len(articles),
+                AuthorArticleRelation.__tablename__: len(relations), CrawlState.__tablename__: len(states),
+                ArticleBody.__tablename__: len(bodies), ContentFingerprint.__tablename__: len(fingerprints),
+                SeenUrl.__tablename__: len(seen_urls), AuthorRefresh.__tablename__: len(refreshes)}
+
+    def buffered_writer(self, batch_size=100, flush_interval=5.0, body_codec=DEFAULT_BODY_CODEC, auto_flush=True):
+        """:returns a BufferedWriter that writes into this database"""
+
+        return BufferedWriter(self, batch_size, flush_interval, body_codec, auto_flush)
 
     def get_last_blog_date(self):
         """:returns the date of the newest blog in the database"""
 
-        last_date = self.get_session().query(Article.pub_date).order_by(desc(Article.pub_date)).first()
+        with self.session_scope() as session:
+            last_date = session.query(Article.pub_date).order_by(desc(Article.pub_date)).first()
         if last_date is not None:
             last_date = last_date[0]
         return last_date
+
+
+class BufferedWriter:
+    """Collects rows for the crawl tables and writes them in bulk, inside one transaction per flush.
+
+    A flush happens when batch_size rows are buffered, when flush_interval seconds passed since the
+    last flush or when flush() is called explicitly. Without auto_flush the owner checks flush_due() and
+    writes the batches it takes, e.g. on another thread.
+    """
+
+    logger = logging.getLogger("Buffered Writer")
+
+    def __init__(self, db_controller, batch_size=100, flush_interval=5.0, body_codec=DEFAULT_BODY_CODEC,
+                 auto_flush=True):
+        self.db_controller = db_controller
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.body_codec = body_codec
+        self.auto_flush = auto_flush
+        self.rows_written = {Author.__tablename__: 0, Article.__tablename__: 0,
+                             AuthorArticleRelation.__tablename__: 0, CrawlState.__tablename__: 0,
+                             ArticleBody.__tablename__: 0, ContentFingerprint.__tablename__: 0,
+                             SeenUrl.__tablename__: 0, AuthorRefresh.__tablename__: 0}
+        self.body_bytes = {"raw_bytes": 0, "compressed_bytes": 0}
+        self.flush_count = 0
+        self.flush_time = 0.0
+        self.failed_batches = 0
+        self._last_flush = time.monotonic()
+        self._fresh_authors = set()
+        self._buffers = self._empty_buffers()
+
+    @staticmethod
+    def _empty_buffers():
+        return {"authors": [], "articles": [], "relations": [], "states": [], "bodies": [], "fingerprints": [],
+                "seen_urls": [], "author_refreshes": []}
+
+    def __len__(self):
+        return sum(map(len, self._buffers.values()))
+
+    def _add(self, kind, row):
+        self._buffers[kind].append(row)
+        if self.auto_flush and self.flush_due():
+            self.flush()
+
+    def flush_due(self):
+        """:returns whether batch_size rows are buffered or flush_interval passed since the last flush"""
+
+        return len(self) >= self.batch_size or \
+            (len(self) > 0 and time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def add_author(self, **author):
+        """Buffers an author row"""
+
+        self._fresh_authors.add(author["url"])
+        self._add("authors", author)
+
+    def add_article(self, **article):
+        """Buffers an article row"""
+
+        self._add("articles", article)
+
+    def add_relation(self, author_url, article_url):
+        """Buffers an author-article relation and the counter update of its author"""
+
+        self._add("relations", {"author_url": author_url, "article_url": article_url})
+
+    def add_section_state(self, **state):
+        """Buffers the crawl state of a section"""
+
+        self._add("states", state)
+
+    def add_body(self, article_url, body):
+        """Buffers the full body of an article"""
+
+        self._add("bodies", {"article_url": article_url, "body": body})
+
+    def add_fingerprint(self, **fingerprint):
+        """Buffers the fingerprint of a parsed page"""
+
+        self._add("fingerprints", fingerprint)
+
+    def add_seen_url(self, url):
+        """Buffers a scraped url, so the following crawls do not request it again"""
+
+        self._add("seen_urls", url)
+
+    def add_author_refresh(self, **refresh):
+        """Buffers the time and validators of a scraped author page"""
+
+        self._add("author_refreshes", dict(refresh, last_scraped_at=datetime.utcnow()))
+
+    def flush(self):
+        """Writes all the buffered rows in a single transaction"""
+
+        batch = self.take()
+        if batch is not None:
+            self.write(batch)
+
+    def take(self):
+        """Empties the buffers
+
+        :returns the batch of buffered rows to pass to write() or None if nothing was buffered
+        """
+
+        self._last_flush = time.monotonic()
+        if not len(self):
+            return None
+        buffers, self._buffers = self._buffers, self._empty_buffers()
+        # the authors of the whole crawl, shared rather than copied per batch, the writer only tests membership
+        return buffers, self._fresh_authors
+
+    def write(self, batch):
+        """Writes a batch taken from the buffers in a single transaction, batches must be written in the order
+        they were taken"""
+
+        buffers, fresh_authors = batch
+        started = time.perf_counter()
+        try:
+            self._write_batch(buffers, fresh_authors)
+        except Exception:
+            self.failed_batches += 1
+            raise
+        finally:
+            self.flush_count += 1
+            self.flush_time += time.perf_counter() - started
+
+    def _write_batch(self, buffers, fresh_authors):
+        try:
+            with self.db_controller.engine.begin() as connection:
+                written = self._write(connection, buffers, fresh_authors)
+            self._count(written)
+        except db.exc.IntegrityError:
+            self.logger.warning("Bulk write of {} rows failed, retrying row by row".format(
+                sum(map(len, buffers.values()))))
+            self._write_row_by_row(buffers, fresh_authors)
+
+    def _count(self, written):
+        """Adds the rows and body bytes of a committed transaction to the totals"""
+
+        for name, count in written.items():
+            if name in self.body_bytes:
+                self.body_bytes[name] += count
+            else:
+                self.rows_written[name] += count
+
+    def _write(self, connection, buffers, fresh_authors):
+        """:returns Counter of table name, raw_bytes and compressed_bytes to the amount written by the transaction"""
+
+        written = Counter()
+        if buffers["authors"]:
+            written[Author.__tablename__] += self.db_controller.upsert_authors(buffers["authors"], connection)
+        if buffers["articles"]:
+            written[Article.__tablename__] += self.db_controller.upsert_articles(buffers["articles"], connection)
+        if buffers["relations"]:
+            new_relations = self.db_controller.upsert_relations(buffers["relations"], connection, fresh_authors)
+            written[AuthorArticleRelation.__tablename__] += len(new_relations)
+        if buffers["states"]:
+            written[CrawlState.__tablename__] += \
+                self.db_controller.upsert_crawl_states(buffers["states"], connection)
+        if buffers["bodies"]:
+            bodies = self.db_controller.upsert_bodies(buffers["bodies"], connection, self.body_codec)
+            written[ArticleBody.__tablename__] += bodies["bodies"]
+            written["raw_bytes"] += bodies["raw_bytes"]
+            written["compressed_bytes"] += bodies["compressed_bytes"]
+        if buffers["fingerprints"]:
+            written[ContentFingerprint.__tablename__] += \
+                self.db_controller.upsert_fingerprints(buffers["fingerprints"], connection)
+        if buffers["seen_urls"]:
+            written[SeenUrl.__tablename__] += self.db_controller.upsert_seen_urls(buffers["seen_urls"], connection)
+        if buffers["author_refreshes"]:
+            written[AuthorRefresh.__tablename__] += \
+                self.db_controller.upsert_author_refreshes(buffers["author_refreshes"], connection)
+        return written
+
+    def _write_row_by_row(self, buffers, fresh_authors):
+        for kind, rows in buffers.items():
+            for row in rows:
+                single = self._empty_buffers()
+                single[kind].append(row)
+                try:
+                    with self.db_controller.engine.begin() as connection:
+                        written = self._write(connection, single, fresh_authors)
+                except db.exc.IntegrityError as e:
+                    self.logger.error("Skipping row that can not be written: {}".format(e.params))
+                else:
+                    self._count(written)
+
+    def stats(self):
+        """:returns a dict with the number of rows written per table, the time spent flushing and the number of
+        batches that failed to be written"""
+
+        stats = dict(self.rows_written, flushes=self.flush_count, flush_time=round(self.flush_time, 4),
+                     failed_batches=self.failed_batches)
+        if self.rows_written[ArticleBody.__tablename__]:
+            stats.update(self.body_bytes, body_compression_ratio=round(
+                self.body_bytes["raw_bytes"] / self.body_bytes["compressed_bytes"], 2))
+        return stats
@@ -0,0 +1,91 @@
+"""Renders report charts into image files with explicit Agg figures, in parallel and cached by their data
+
+A chart is a draw function and the DataFrame it draws. The digest of the data, the draw function and the image format
+of every chart rendered into a directory is kept in <output>/_render_cache.json, a chart whose digest did not change
+is served from the directory instead of being rendered again.
+"""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger("Renderer")
+
+CACHE_FILE = "_render_cache.json"
+
+
+def chart_digest(draw, data, image_format):
+    """:returns hex digest of everything the rendered chart depends on"""
+
+    digest = hashlib.sha256()
+    for part in (draw.__module__, draw.__qualname__, image_format):
+        digest.update(part.encode("utf-8") + b"\0")
+    digest.update(draw.__code__.co_code)
+    digest.update(data.to_json(orient="split", date_format="iso").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_chart(draw, data, path, image_format):
+    """Draws the data on a new Agg figure and writes it to path, the file is replaced only when it is complete"""
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    draw(figure, data)
+    temporary = path + ".tmp"
+    figure.savefig(temporary, format=image_format)
+    os.replace(temporary, path)
+    return path
+
+
+def _read_cache(output_dir):
+    path = os.path.join(output_dir, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_cache(output_dir, cache):
+    path = os.path.join(output_dir, CACHE_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def render_charts(charts, output_dir, image_format="png", processes=None):
+    """Renders the charts whose data changed since they were rendered into output_dir as <name>.<image_format>
+
+    :param charts: dict of chart name to (draw function, DataFrame), draw(figure, data) draws on the given Figure
+    :param processes: size of the process pool rendering the charts, the number of CPUs by default
+    :returns list of the chart paths, in the order of the charts
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    cache = _read_cache(output_dir)
+    paths, stale = [], {}
+    for name, (draw, data) in charts.items():
+        file_name = "{}.{}".format(name, image_format)
+        path = os.path.join(output_dir, file_name)
+        paths.append(path)
+        digest = chart_digest(draw, data, image_format)
+        if cache.get(file_name) != digest or not os.path.exists(path):
+            stale[file_name] = (draw, data, path, digest)
+
+    processes = min(len(stale), processes or os.cpu_count() or 1)
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            for future in [pool.submit(render_chart, draw, data, path, image_format)
+                           for draw, data, path, _ in stale.values()]:
+                future.result()
+    else:
+        for draw, data, path, _ in stale.values():
+            render_chart(draw, data, path, image_format)
+    if stale:
+        cache.update({file_name: digest for file_name, (_, _, _, digest) in stale.items()})
+        _write_cache(output_dir, cache)
+    log.info("Rendered {} charts, {} unchanged".format(len(stale), len(paths) - len(stale)))
+    return paths
@@ -1,10 +1,9 @@
 import pandas as pd
-import sqlalchemy
 import numpy as np
 import logging
-from matplotlib import pyplot as plt
-from scrape import start
-from models import DatabaseController, Author, AuthorArticleRelation, Article
+from models import DatabaseController
+from render import render_charts
+from trends import fastest_growing_tags, rolling_counts
 from grid_blog_crawl.settings import DATABASE_NAME
 
 log = logging.getLogger("Report Generator")
@@ -14,100 +13,125 @@ def top_5_articles(dbc: DatabaseController):
     """:returns str containing a table with 5 newest articles"""
 
     log.info("Generating top 5 articles report")
-    session = dbc.get_session()
-    df = pd.read_sql_query(session.query(Article.title, Article.pub_date, Article.tags, Article.url,
-                                         Author.name.label("authors"))
-                           .join(AuthorArticleRelation, AuthorArticleRelation.article_url == Article.url)
-                           .join(Author, Author.url == AuthorArticleRelation.author_url)
-                           .statement, session.bind)
-
-    df = df.groupby(['url', 'title', 'pub_date', 'tags'])['authors']\
-        .apply(', '.join).reset_index().sort_values('pub_date', ascending=False).head(5)
-
-    df.tags = df.tags.map(lambda x: x.replace(":::", ", "))
-    return df
+    return pd.DataFrame(dbc.get_newest_articles(5), columns=['url', 'title', 'pub_date', 'tags', 'authors'])
 
 
 def get_top_7_tags(dbc: DatabaseController):
     """:returns a df showing top 7 most popular tags"""
-    session = dbc.get_session()
-    df = pd.read_sql_query(session.query(Article).statement, session.bind)
-    df = df[df.tags.notnull()]
-    df['tags'] = df['tags'].apply(lambda x: x.strip())
-    new_df = pd.DataFrame(df.tags.str.split(':::').tolist(), df.title).stack().reset_index(name="tag")
-    new_df = new_df.drop('title', axis=1)
-    new_df = new_df.groupby(['tag'])["level_1"].count().reset_index(name="counts")
-    new_df = new_df.sort_values('counts', ascending=False)
-    return new_df.head(7)
-
-
-def create_top_7_tags_plot(dbc: DatabaseController):
-    """Creates a bar plot showing top 7 most popular tags"""
-
-    log.info("Generating top 7 tags plot")
-    top_tags = get_top_7_tags(dbc)
-    plt.title("Popular tags")
+
+    return pd.DataFrame(dbc.get_tag_counts(7), columns=["tag", "counts"])
+
+
+def draw_top_7_tags(figure, top_tags):
+    """Draws a bar plot showing top 7 most popular tags on the figure"""
+
+    ax = figure.subplots()
+    ax.set_title("Popular tags")
     xrange = range(len(top_tags))
-    plt.xticks(xrange, top_tags.tag, rotation='vertical')
-    plt.bar(xrange, top_tags.counts, edgecolor="black", color='red')
-    plt.tight_layout()
+    ax.set_xticks(xrange)
+    ax.set_xticklabels(top_tags.tag, rotation='vertical')
+    ax.bar(xrange, top_tags.counts, edgecolor="black", color='red')
+    figure.tight_layout()
 
 
 def get_top_5_authors(dbc: DatabaseController):
     """:returns a df comparison of the article counters of top 5 authors"""
-    session = dbc.get_session()
-    df_s = pd.read_sql_query(session.query(Author.name, Author.articles_count,
-                                           sqlalchemy.func.count(AuthorArticleRelation.article_url)
-                                           .label("article_relation_table_count"))
-                             .group_by(Author.name)
-                             .join(Author, AuthorArticleRelation.author_url == Author.url)
-                             .statement
-                             , session.bind)
-    top5 = df_s.sort_values('articles_count', ascending=False).head(5)
-    return top5
-
-
-def create_top_5_authors_plot(dbc: DatabaseController):
-    """Creates a bar comparison of the article counters and returns a table with top 5 authors"""
-
-    log.info("Generating top 5 authors plot & report")
-
-    top5 = get_top_5_authors(dbc)
-    fig, ax1 = plt.subplots()
-    plt.title("Top 5 Authors")
-    plt.ylabel("num. of articles")
+
+    return pd.DataFrame(dbc.get_top_authors(5), columns=['name', 'articles_count', 'article_relation_table_count'])
+
+
+def draw_top_5_authors(figure, top5):
+    """Draws a bar comparison of the article counters of top 5 authors on the figure"""
+
+    ax1 = figure.subplots()
+    ax1.set_title("Top 5 Authors")
+    ax1.set_ylabel("num. of articles")
     y_range = range(max(top5.articles_count.max(), top5.article_relation_table_count.max()) + 2)
     row_range = np.arange(len(top5))
-    plt.xticks(row_range, top5.name, rotation='vertical')
+    ax1.set_xticks(row_range)
+    ax1.set_xticklabels(top5.name, rotation='vertical')
 
     width = 0.3
     ac_list = ax1.bar(row_range, top5.articles_count, edgecolor="black", width=width, color='b', align='center')
     ax2 = ax1.twinx()
     ac_rel = ax2.bar(row_range + width, top5.article_relation_table_count, edgecolor="black", width=width,
                      color='orange', align='center')
-    plt.legend([ac_list, ac_rel],
+    ax2.legend([ac_list, ac_rel],
                ["According to author specific page blog listings", "According to blog specific page"])
     ax1.set_yticks(y_range)
     ax2.set_yticks(y_range)
-    plt.tight_layout()
-    return top5
+    figure.tight_layout()
+
+
+TABLE_FORMATS = ("json", "csv")
+IMAGE_FORMATS = ("png", "svg")
+REPORT_DIR = "report"
+
+
+def get_report_tables(dbc: DatabaseController):
+    """:returns dict of report table name to its df"""
+
+    return {"top_5_articles": top_5_articles(dbc), "top_5_authors": get_top_5_authors(dbc),
+            "top_7_tags": get_top_7_tags(dbc)}
+
+
+def search_articles(dbc: DatabaseController, query, limit=10, tag=None, since=None):
+    """:returns a df with the articles best matching the full-text query"""
+
+    return pd.DataFrame(dbc.search(query, limit, tag, since), columns=['url', 'title', 'pub_date', 'snippet', 'rank'])
+
+
+def growing_tags(dbc: DatabaseController, weeks=4, limit=10, until=None):
+    """:returns a df with the tags whose number of articles grew the most in the last weeks"""
+
+    return pd.DataFrame(fastest_growing_tags(dbc, weeks, limit, until), columns=['tag', 'recent', 'previous', 'growth'])
+
+
+def trend(dbc: DatabaseController, period="week", window=4, tag=None, author_url=None, since=None, until=None):
+    """:returns a df with the number of articles of the tag or the author per bucket and per rolling window"""
+
+    return pd.DataFrame(rolling_counts(dbc, period, window, tag, author_url, since, until),
+                        columns=['bucket', 'articles', 'window_articles'])
+
+
+def format_tables(tables: dict, table_format="json"):
+    """:returns str with the tables as a JSON object of row lists or as CSV tables preceded by '# <name>' lines"""
+
+    if table_format == "json":
+        return "{" + ", ".join('"{}": {}'.format(name, df.to_json(orient="records", date_format="iso"))
+                               for name, df in tables.items()) + "}"
+    if table_format == "csv":
+        return "\n".join("# {}\n{}".format(name, df.to_csv(index=False)) for name, df in tables.items())
+    raise ValueError("Unknown table format {}, expected one of {}".format(table_format, ", ".join(TABLE_FORMATS)))
+
+
+def save_plots(dbc: DatabaseController, output_dir, image_format="png", processes=None):
+    """Renders the report plots into output_dir, plots whose data did not change since the last render are kept
+
+    :param processes: size of the process pool rendering the plots, the number of CPUs by default
+    :returns list of the plot file paths
+    """
+
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError("Unknown image format {}, expected one of {}".format(image_format, ", ".join(IMAGE_FORMATS)))
+    log.info("Generating report plots")
+    charts = {"top_7_tags": (draw_top_7_tags, get_top_7_tags(dbc)),
+              "top_5_authors": (draw_top_5_authors, get_top_5_authors(dbc))}
+    return render_charts(charts, output_dir, image_format, processes)
 
 
 def run():
+    from scrape import start
+
     start()
-    dbc = DatabaseController(DATABASE_NAME)
-    create_top_7_tags_plot(dbc)
-    plt.figure(1)
-    print(create_top_5_authors_plot(dbc).to_string(index=False))
-    # print(top_5_articles(dbc).to_string(index=False))
+    dbc = DatabaseController.shared(DATABASE_NAME)
+    for path in save_plots(dbc, REPORT_DIR):
+        log.info("Plot written to {}".format(path))
+    print(get_top_5_authors(dbc).to_string(index=False))
     df = top_5_articles(dbc)
     with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'max_colwidth', 200):
         print(df)
 
-    plt.show()
-
 
 if __name__ == "__main__":
     run()
-
-
@@ -1,8 +1,14 @@
 import logging
+import os
+import sys
+import tempfile
+from multiprocessing import Process
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
+from grid_blog_crawl.metrics import REGISTRY
 from grid_blog_crawl.spiders.article_spider import ArticleSpider
 from grid_blog_crawl.spiders.author_spider import AuthorSpider
+from models import DatabaseController
 
 
 def start_sequentially(process: CrawlerProcess, crawlers: list):
@@ -14,14 +20,107 @@ def start_sequentially(process: CrawlerProcess, crawlers: list):
         deferred.addCallback(lambda _: start_sequentially(process, crawlers[1:]))
 
 
-def start():
-    """Starts the blog.griddynamics scraping"""
+def get_crawl_settings(profile=None):
+    """:returns project settings with the crawl profile applied, CRAWL_PROFILE setting is used when None"""
 
-    crawlers = [ArticleSpider, AuthorSpider]
-    process = CrawlerProcess(settings=get_project_settings())
+    settings = get_project_settings()
+    profile = profile or settings.get('CRAWL_PROFILE')
+    if profile is not None:
+        profiles = settings.getdict('CRAWL_PROFILES')
+        if profile not in profiles:
+            raise ValueError('Unknown crawl profile {}, expected one of {}'.format(profile, ', '.join(profiles)))
+        settings.setdict(profiles[profile], priority='cmdline')
+        settings.set('CRAWL_PROFILE', profile, priority='cmdline')
+    return settings
+
+
+def start(stream_authors=None, profile=None, shards=None):
+    """Starts the blog.griddynamics scraping
+
+    :param stream_authors: crawl author pages together with the articles instead of after them,
+    STREAM_AUTHORS setting is used when None
+    :param profile: name of the crawl profile from CRAWL_PROFILES setting, CRAWL_PROFILE setting is used when None
+    :param shards: number of worker processes to split the crawl across, CRAWL_SHARDS setting is used when None
+    """
+
+    settings = get_crawl_settings(profile)
+    if stream_authors is not None:
+        settings.set('STREAM_AUTHORS', stream_authors)
+    crawlers = [ArticleSpider] if settings.getbool('STREAM_AUTHORS') else [ArticleSpider, AuthorSpider]
+    shards = shards or settings.getint('CRAWL_SHARDS')
+    if shards > 1:
+        start_sharded(settings, crawlers, shards)
+        return
+    process = CrawlerProcess(settings=settings)
     start_sequentially(process, crawlers)
     process.start()
+    export_metrics(settings)
+
+
+def crawl_shard(settings, crawler, shard_index, shard_count, staging_db_name):
+    """Crawls the shard of the blog into the staging database, runs in a worker process of a sharded crawl"""
+
+    settings.setdict({'SHARD_INDEX': shard_index, 'SHARD_COUNT': shard_count,
+                      'STAGING_DATABASE_NAME': staging_db_name}, priority='cmdline')
+    if settings.get('METRICS_FILE'):
+        name, extension = os.path.splitext(settings.get('METRICS_FILE'))
+        settings.set('METRICS_FILE', '{}-shard{}{}'.format(name, shard_index, extension), priority='cmdline')
+    process = CrawlerProcess(settings=settings)
+    failures = []
+    process.crawl(crawler).addErrback(failures.append)
+    process.start()
+    export_metrics(settings)
+    if failures:
+        failures[0].raiseException()
+
+
+def start_sharded(settings, crawlers, shards):
+    """Runs every crawler in shards worker processes, one crawler after another
+
+    Article spider workers crawl every shards-th blog section and author spider workers the author pages whose url
+    hashes into their shard. Workers write into their own staging database, the staging databases are merged into
+    DATABASE_NAME in shard order after all the workers of a crawler finished, so the next crawler sees the result.
+    """
+
+    # creates and migrates the database before the workers open it concurrently
+    DatabaseController(settings.get('DATABASE_NAME')).dispose()
+    with tempfile.TemporaryDirectory(prefix='crawl-shards-') as directory:
+        for crawler in crawlers:
+            staging_db_names = [os.path.join(directory, '{}-{}.db'.format(crawler.name, shard_index))
+                                for shard_index in range(shards)]
+            workers = [Process(target=crawl_shard, args=(settings.copy(), crawler, shard_index, shards, staging))
+                       for shard_index, staging in enumerate(staging_db_names)]
+            logging.info('start crawler {} in {} shards'.format(crawler.__name__, shards))
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            failed = [shard_index for shard_index, worker in enumerate(workers) if worker.exitcode != 0]
+            if failed:
+                raise RuntimeError('Shards {} of crawler {} failed'.format(failed, crawler.__name__))
+            # not shared, so the workers of the next crawler do not inherit its pooled connections
+            database = DatabaseController(settings.get('DATABASE_NAME'))
+            for staging_db_name in staging_db_names:
+                staging = DatabaseController(staging_db_name)
+                logging.info('merged {}: {}'.format(staging_db_name, database.merge(staging)))
+                staging.dispose()
+            database.dispose()
+
+
+def export_metrics(settings):
+    """Writes the metrics collected during the crawl to METRICS_FILE"""
+
+    if settings.getbool('METRICS_ENABLED') and settings.get('METRICS_FILE'):
+        REGISTRY.write(settings.get('METRICS_FILE'))
+        logging.info('Crawl metrics written to {}'.format(settings.get('METRICS_FILE')))
+
+
+def main(argv=None):
+    """Crawls with the arguments of `cli.py crawl`, which this entry point is kept as an alias of"""
+
+    from cli import main as cli_main
+    cli_main(['crawl'] + (sys.argv[1:] if argv is None else list(argv)))
 
 
 if __name__ == "__main__":
-    start()
+    main()
@@ -1,13 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-from models import DatabaseController
-from report import top_5_articles, get_top_5_authors, get_top_7_tags
+import export
+import pandas as pd
+import render
+from graph import RelationGraph
+from trends import fastest_growing_tags, rolling_counts
+from models import Article, Author, ContentFingerprint, DatabaseController
+from grid_blog_crawl.spiders.article_spider import ArticleSpider
+from grid_blog_crawl.spiders.author_spider import author_refresh_requests
+from scrape import get_crawl_settings, main as scrape_main
+from grid_blog_crawl.metrics import MetricsRegistry
+from grid_blog_crawl.items import ArticleAuthorItem, ArticleItem
+from grid_blog_crawl.pipelines import GridBlogSpiderPipeline, in_shard
+from grid_blog_crawl.dupefilters import SeenUrlDupeFilter
+from grid_blog_crawl.urls import canonicalize_url
+from scrapy.http import HtmlResponse, Request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+from benchmarks.bench_article_parser import FIXTURES, load_response
+from benchmarks.blog_server import SyntheticBlog
+from grid_blog_crawl.extractors import extract_article, extract_body
+from report import top_5_articles, get_top_5_authors, get_top_7_tags, get_report_tables, format_tables, \
+    save_plots, draw_top_7_tags
 
 
-class ReportTests(unittest.TestCase):
+class TemporaryDatabaseTestCase(unittest.TestCase):
+    """Gives every test a controller of a new database in a temporary file, a copy of fixture when it is set"""
+
+    fixture = None
 
     def setUp(self):
-        self.dbc = DatabaseController("test_data.db")
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        if self.fixture is not None:
+            shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), self.fixture), self.db_path)
+        self.dbc = DatabaseController(self.db_path)
+        self.addCleanup(self.dbc.dispose)
+
+
+class ReportTests(TemporaryDatabaseTestCase):
+
+    fixture = "test_data.db"
 
     def test_top_5_articles(self):
         expected = ['Launch new digital services faster with distributed teams and agile co-creation delivery model',
@@ -36,6 +78,633 @@ class ReportTests(unittest.TestCase):
                     'Data science toolkit']
         self.assertEqual(get_top_7_tags(self.dbc).tag.tolist(), expected)
 
+    def test_report_output_formats(self):
+        tables = get_report_tables(self.dbc)
+        parsed = json.loads(format_tables(tables, "json"))
+        self.assertEqual([row["name"] for row in parsed["top_5_authors"]], tables["top_5_authors"].name.tolist())
+        self.assertIn("# top_7_tags\ntag,counts\n", format_tables(tables, "csv"))
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_plots(self.dbc, directory, "svg")
+            self.assertEqual([os.path.basename(path) for path in paths], ["top_7_tags.svg", "top_5_authors.svg"])
+            self.assertTrue(all(os.path.getsize(path) > 0 for path in paths))
+
+    def test_unchanged_charts_are_not_rendered_again(self):
+        data = pd.DataFrame({"tag": ["t1", "t2"], "counts": [3, 1]})
+        charts = {"tags": (draw_top_7_tags, data), "more_tags": (draw_top_7_tags, data.head(1))}
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("render.render_chart", wraps=render.render_chart) as render_chart:
+                paths = render.render_charts(charts, directory, "svg", processes=1)
+                render.render_charts(charts, directory, "svg", processes=1)
+                self.assertEqual(render_chart.call_count, 2)
+                charts["tags"] = (draw_top_7_tags, data.assign(counts=[4, 1]))
+                render.render_charts(charts, directory, "svg", processes=1)
+                self.assertEqual(render_chart.call_count, 3)
+            for path in paths:
+                os.remove(path)
+            self.assertEqual(render.render_charts(charts, directory, "svg", processes=2), paths)
+            self.assertTrue(all(os.path.getsize(path) > 0 for path in paths))
+
+
+class BufferedWriterTests(TemporaryDatabaseTestCase):
+
+    def test_rows_are_written_on_flush(self):
+        writer = self.dbc.buffered_writer(batch_size=100, flush_interval=60)
+        writer.add_author(url="a1", name="Author", articles_count=1)
+        writer.add_article(url="u1", title="Title", pub_date=date(2020, 3, 1), text="text", tags="t1:::t2")
+        writer.add_relation("a1", "u1")
+        self.assertEqual(self.dbc.get_articles().count(), 0)
+
+        writer.flush()
+        self.assertEqual(self.dbc.get_articles().count(), 1)
+        self.assertEqual(self.dbc.get_author("a1").articles_count, 1)
+        self.assertEqual(writer.stats()["author_article"], 1)
+
+    def test_counter_of_previously_scraped_author_is_incremented(self):
+        self.dbc.upsert_authors([dict(url="a1", name="Author", articles_count=1)])
+        writer = self.dbc.buffered_writer(batch_size=100, flush_interval=60)
+        writer.add_relation("a1", "u1")
+        writer.flush()
+        self.assertEqual(self.dbc.get_author("a1").articles_count, 2)
+
+    def test_batch_size_triggers_flush(self):
+        writer = self.dbc.buffered_writer(batch_size=2, flush_interval=60)
+        writer.add_author(url="a1", name="Author", articles_count=0)
+        writer.add_author(url="a2", name="Author", articles_count=0)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(self.dbc.get_authors().count(), 2)
+
+    def test_rewritten_rows_are_upserted(self):
+        writer = self.dbc.buffered_writer(batch_size=100, flush_interval=60)
+        writer.add_author(url="a1", name="Author", articles_count=0)
+        writer.add_relation("a1", "u1")
+        writer.flush()
+        writer.add_author(url="a1", name="Renamed", articles_count=1)
+        writer.add_author(url="a2", name="Author", articles_count=0)
+        writer.add_relation("a1", "u1")
+        writer.add_relation("a1", "u1")
+        writer.flush()
+        self.assertEqual(self.dbc.get_authors().count(), 2)
+        self.assertEqual(self.dbc.get_author("a1").name, "Renamed")
+        self.assertEqual(self.dbc.get_author("a1").articles_count, 1)
+        self.assertEqual(self.dbc.get_article_author().count(), 1)
+
+    def test_fresh_authors_are_not_copied_per_batch(self):
+        writer = self.dbc.buffered_writer(batch_size=100, flush_interval=60, auto_flush=False)
+        writer.add_author(url="a1", name="Author", articles_count=1)
+        _, fresh_authors = writer.take()
+        writer.add_relation("a1", "u1")
+        self.assertIs(writer.take()[1], fresh_authors)
+        self.assertEqual(fresh_authors, {"a1"})
+
+    def test_rows_retried_after_failed_batch_are_counted_once(self):
+        writer = self.dbc.buffered_writer(batch_size=100, flush_interval=60)
+        writer.add_author(url="a1", name="Author", articles_count=1)
+        writer.add_article(url="u1", title="Title", pub_date=date(2020, 3, 1), text="text", tags="t1")
+        writer.add_article(url="u2", title=None, pub_date=date(2020, 3, 1), text="text", tags="t1")
+        writer.flush()
+        self.assertEqual((writer.stats()["authors"], writer.stats()["articles"]), (1, 1))
+        self.assertEqual(self.dbc.get_authors().count(), 1)
+
+
+class PipelineTests(TemporaryDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pipeline = GridBlogSpiderPipeline(self.db_path, "https://blog", batch_size=3, flush_interval=60,
+                                               pool_options={}, write_queue_size=1)
+        self.batches = []
+
+        def defer_write(batch, spider_name):
+            self.batches.append((batch, Deferred()))
+            return self.batches[-1][1]
+
+        self.pipeline._defer_write = defer_write
+
+    def tearDown(self):
+        self.pipeline.db_controller.dispose()
+
+    def test_full_write_queue_holds_items_back_in_order(self):
+        spider = ArticleSpider()
+        article = ArticleItem(url="u1", title="T1", pub_date=date(2020, 3, 1), text="text", tags="t1")
+        relation = ArticleAuthorItem(article_url="u1", authors=["a1"])
+        self.assertIs(self.pipeline.process_item(article, spider), article)
+        self.assertIs(self.pipeline.process_item(relation, spider), relation)
+        second = ArticleItem(article, url="u2")
+        held_back = [self.pipeline.process_item(second, spider),
+                     self.pipeline.process_item(ArticleAuthorItem(article_url="u2", authors=["a1"]), spider)]
+        self.assertIsInstance(held_back[1], Deferred)
+        self.assertEqual(len(self.batches), 1)
+
+        released = []
+        held_back[1].addCallback(released.append)
+        batch, write = self.batches[0]
+        self.pipeline.writer.write(batch)
+        write.callback(None)
+        self.assertEqual([item["article_url"] for item in released], ["u2"])
+        self.assertEqual([[row["url"] for row in batch[0]["articles"]] for batch, _ in self.batches], [["u1"], ["u2"]])
+        self.assertEqual(self.pipeline.writer.rows_written["author_article"], 1)
+
+    def _crawl_section(self, failed_article):
+        """Crawls a section page with four new articles, the first one failing when failed_article is set
+        :returns the crawl states written by the pipeline"""
+
+        spider = ArticleSpider()
+        spider.root_url = "https://blog"
+        self.pipeline._defer_write = lambda batch, spider_name: maybeDeferred(
+            self.pipeline._write_batch, batch, spider_name)
+        page = spider._track(spider._section_request("https://blog/section/"), "https://blog/section/")
+        first, *articles, next_page = spider.parse_article_multi_record_page(HtmlResponse(
+            page.url, body=ArticleSpiderTests.SECTION_PAGE.encode(), encoding='utf-8', request=page))
+        self.assertEqual(self.pipeline.process_item(ArticleItem(url=first.url, title="T", pub_date=date(2020, 3, 30),
+                                                                text="text"), spider)["url"], first.url)
+        if failed_article:
+            failure = Failure(ConnectionRefusedError())
+            failure.request = first
+            first.errback(failure)
+        else:
+            spider.request_dropped(first, spider)
+        for article in articles:
+            spider.request_dropped(article, spider)
+        self.assertEqual(list(next_page.callback(HtmlResponse(next_page.url, body=b"<html></html>",
+                                                              request=next_page))), [])
+        self.pipeline.close_spider(spider)
+        return self.dbc.get_crawl_states()
+
+    def test_section_state_is_written_once_its_requests_succeeded(self):
+        states = self._crawl_section(failed_article=False)
+        self.assertEqual(states["https://blog/section/"]["watermark"], date(2020, 3, 30))
+
+    def test_failed_article_request_keeps_the_section_watermark(self):
+        self.assertEqual(self._crawl_section(failed_article=True), {})
+
+    def test_failed_batch_fails_spider_close(self):
+        spider = ArticleSpider()
+        self.pipeline._defer_write = lambda batch, spider_name: maybeDeferred(
+            self.pipeline._write_batch, batch, spider_name)
+        self.pipeline.process_item(ArticleItem(url="u1", title="T1", pub_date=date(2020, 3, 1), text="text"), spider)
+        failures = []
+        with mock.patch.object(self.pipeline.db_controller, "upsert_articles",
+                               side_effect=OperationalError("INSERT", {}, Exception("database is locked"))):
+            self.pipeline.close_spider(spider).addErrback(failures.append)
+        self.assertEqual(self.pipeline.writer.stats()["failed_batches"], 1)
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(failures[0].value, RuntimeError)
+
+
+class DatabaseControllerTests(TemporaryDatabaseTestCase):
+
+    def test_upsert_articles_updates_existing(self):
+        article = dict(url="u1", title="Title", pub_date=date(2020, 3, 1), text="text", tags="t1")
+        self.dbc.upsert_articles([article])
+        self.dbc.upsert_articles([dict(article, title="New title")])
+        articles = self.dbc.get_articles().all()
+        self.assertEqual([(a.title, a.pub_date) for a in articles], [("New title", date(2020, 3, 1))])
+
+    def test_counter_incremented_only_for_new_relations(self):
+        self.dbc.upsert_authors([dict(url="a1", name="Author", articles_count=3)])
+        new = self.dbc.upsert_relations([dict(author_url="a1", article_url="u1"),
+                                         dict(author_url="a1", article_url="u2")])
+        self.assertEqual(len(new), 2)
+        new = self.dbc.upsert_relations([dict(author_url="a1", article_url="u1")])
+        self.assertEqual(new, [])
+        self.assertEqual(self.dbc.get_author("a1").articles_count, 5)
+
+    def test_relations_are_inserted_with_one_statement(self):
+        inserts = []
+
+        def listener(conn, cursor, statement, *args):
+            if statement.startswith("INSERT INTO author_article"):
+                inserts.append(statement)
+
+        event.listen(self.dbc.engine, "before_cursor_execute", listener)
+        new = self.dbc.upsert_relations([dict(author_url="a{}".format(i % 3), article_url="u1") for i in range(5)])
+        event.remove(self.dbc.engine, "before_cursor_execute", listener)
+        self.assertEqual(sorted(row["author_url"] for row in new), ["a0", "a1", "a2"])
+        self.assertEqual(len(inserts), 1)
+
+    def test_fresh_author_counter_is_not_incremented(self):
+        self.dbc.upsert_authors([dict(url="a1", name="Author", articles_count=3)])
+        self.dbc.upsert_relations([dict(author_url="a1", article_url="u1")], fresh_authors={"a1"})
+        self.assertEqual(self.dbc.get_author("a1").articles_count, 3)
+
+    def test_tags_follow_article_upserts(self):
+        article = dict(url="u1", title="Title", pub_date=date(2020, 3, 1), text="text", tags="t1:::t2")
+        self.dbc.upsert_articles([article, dict(article, url="u2", tags="t2")])
+        self.assertEqual(self.dbc.get_tag_counts(), [("t2", 2), ("t1", 1)])
+        self.dbc.upsert_articles([dict(article, tags="t3")])
+        self.assertEqual(self.dbc.get_article_tags("u1"), ["t3"])
+        self.assertEqual(self.dbc.get_tag_counts(1), [("t2", 1)])
+
+    def test_summaries_match_rebuild(self):
+        self.dbc.upsert_articles([dict(url="u{}".format(i), title="T{}".format(i), pub_date=date(2020, 3, 1 + i),
+                                       text="text", tags="t1:::t{}".format(i % 2)) for i in range(4)])
+        self.dbc.upsert_relations([dict(author_url="a{}".format(i % 2), article_url="u{}".format(i))
+                                   for i in range(4)])
+        self.dbc.upsert_authors([dict(url="a0", name="Author 0", articles_count=2)])
+        self.dbc.upsert_articles([dict(url="u0", title="T0", pub_date=date(2020, 3, 1), text="text", tags="t2")])
+        incremental = (self.dbc.get_tag_counts(), self.dbc.get_top_authors(5), self.dbc.get_newest_articles(5))
+        self.dbc.rebuild_summaries()
+        self.assertEqual(incremental,
+                         (self.dbc.get_tag_counts(), self.dbc.get_top_authors(5), self.dbc.get_newest_articles(5)))
+        self.assertEqual([article[0] for article in incremental[2]], ["u2", "u0"])
+
+    def test_article_moved_below_newest_kept_matches_rebuild(self):
+        with mock.patch("models.NEWEST_ARTICLES_KEPT", 2):
+            self.dbc.upsert_authors([dict(url="a1", name="Author", articles_count=4)])
+            articles = [dict(url="u{}".format(i), title="T", pub_date=date(2020, 3, 1 + i), text="text")
+                        for i in range(4)]
+            self.dbc.upsert_articles(articles)
+            self.dbc.upsert_relations([dict(author_url="a1", article_url=article["url"]) for article in articles])
+            self.dbc.upsert_articles([dict(articles[3], pub_date=date(2020, 2, 1))])
+            incremental = self.dbc.get_newest_articles(2)
+            self.dbc.rebuild_summaries()
+            self.assertEqual(incremental, self.dbc.get_newest_articles(2))
+        self.assertEqual([article[0] for article in incremental], ["u2", "u1"])
+
+    def test_trend_buckets_match_rebuild(self):
+        self.dbc.upsert_articles([dict(url="u{}".format(i), title="T{}".format(i), pub_date=date(2020, 3, 1 + 7 * i),
+                                       text="text", tags="t1:::t{}".format(i % 2)) for i in range(4)])
+        self.dbc.upsert_relations([dict(author_url="a{}".format(i % 2), article_url="u{}".format(i))
+                                   for i in range(5)])
+        self.dbc.upsert_articles([dict(url="u0", title="T0", pub_date=date(2020, 4, 1), text="text", tags="t2"),
+                                  dict(url="u4", title="T4", pub_date=date(2020, 4, 2), text="text", tags="t1")])
+
+        def trends():
+            return [(self.dbc.get_trend(period, tag=tag), self.dbc.get_trend(period, author_url=author))
+                    for period in ("week", "month") for tag, author in (("t0", "a0"), ("t1", "a1"), ("t2", "a0"))]
+
+        incremental = trends()
+        self.dbc.rebuild_summaries()
+        self.assertEqual(incremental, trends())
+        self.assertEqual(self.dbc.get_trend("month", tag="t1"), [(date(2020, 3, 1), 3), (date(2020, 4, 1), 1)])
+        self.assertEqual(self.dbc.get_trend("week", author_url="a0"),
+                         [(date(2020, 3, 9), 1), (date(2020, 3, 30), 2)])
+
+    def test_rolling_counts_and_growing_tags(self):
+        pub_dates = [date(2020, 3, 2), date(2020, 3, 9), date(2020, 3, 23), date(2020, 3, 24), date(2020, 3, 25)]
+        self.dbc.upsert_articles([dict(url="u{}".format(i), title="T", pub_date=pub_date, text="text",
+                                       tags="old" if i < 2 else "new") for i, pub_date in enumerate(pub_dates)])
+        self.assertEqual(rolling_counts(self.dbc, "week", 2, tag="old"),
+                         [(date(2020, 3, 2), 1, 1), (date(2020, 3, 9), 1, 2), (date(2020, 3, 16), 0, 1),
+                          (date(2020, 3, 23), 0, 0)])
+        self.assertEqual(rolling_counts(self.dbc, "month", 3, tag="new", since=date(2020, 2, 10)),
+                         [(date(2020, 2, 1), 0, 0), (date(2020, 3, 1), 3, 3)])
+        self.assertEqual(rolling_counts(self.dbc, "week", 2, tag="unused", since=date(2020, 3, 17)),
+                         [(date(2020, 3, 16), 0, 0), (date(2020, 3, 23), 0, 0)])
+        self.assertEqual(rolling_counts(self.dbc, "week", 2, tag="unused"), [])
+        self.assertEqual(fastest_growing_tags(self.dbc, weeks=2), [("new", 3, 0, 3)])
+        self.assertEqual(fastest_growing_tags(self.dbc, weeks=2, until=date(2020, 3, 15)), [("old", 2, 0, 2)])
+        with self.assertRaises(ValueError):
+            self.dbc.get_trend("day", tag="new")
+
+    def test_merged_staging_matches_direct_writes(self):
+        fd, staging_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        staging = DatabaseController(staging_path)
+        self.dbc.upsert_authors([dict(url="a0", name="Author 0", articles_count=3)])
+        writer = staging.buffered_writer()
+        writer.add_author(url="a1", name="Author 1", articles_count=1)
+        writer.add_article(url="u1", title="T1", pub_date=date(2020, 3, 1), text="text", tags="t1")
+        for author_url in ("a0", "a1"):
+            writer.add_relation(author_url, "u1")
+        writer.add_section_state(section_url="s1", watermark=date(2020, 3, 1), watermark_urls={"u1"})
+        writer.add_body("u1", "full body")
+        writer.add_seen_url("u1")
+        writer.add_author_refresh(author_url="a1", etag='"v1"', last_modified=None)
+        writer.flush()
+        merged = self.dbc.merge(staging)
+        staging.dispose()
+        os.remove(staging_path)
+        self.assertEqual(merged, {"authors": 1, "articles": 1, "author_article": 2, "crawl_state": 1,
+                                  "article_bodies": 1, "content_fingerprints": 0, "seen_urls": 1,
+                                  "author_refresh": 1})
+        self.assertEqual(self.dbc.get_article_body("u1"), "full body")
+        self.assertEqual({author.url: author.articles_count for author in self.dbc.get_authors()}, {"a0": 4, "a1": 1})
+        self.assertEqual(self.dbc.get_crawl_states()["s1"]["watermark_urls"], ["u1"])
+        self.assertEqual(self.dbc.get_newest_articles(5)[0][4], "Author 0, Author 1")
+        self.assertEqual(self.dbc.get_seen_urls(), {"u1"})
+        self.assertEqual(self.dbc.get_stale_authors(5, min_age=timedelta(0)),
+                         [{"url": "a0", "etag": None, "last_modified": None},
+                          {"url": "a1", "etag": '"v1"', "last_modified": None}])
+
+    def test_not_scraped_authors_are_canonical(self):
+        self.dbc.upsert_authors([dict(url="https://blog.griddynamics.com/author/a/", name="A", articles_count=1)])
+        self.dbc.upsert_relations([dict(author_url=author_url, article_url="u1") for author_url in (
+            "https://blog.griddynamics.com/author/a", "https://blog.griddynamics.com/author/b",
+            "https://blog.griddynamics.com/author/b/")])
+        self.assertEqual(self.dbc.get_not_scraped_authors(), ["https://blog.griddynamics.com/author/b/"])
+
+    def test_stale_authors_are_ranked_by_age_and_drift(self):
+        now = datetime.utcnow()
+        self.dbc.upsert_authors([dict(url="a{}".format(i), name="Author", articles_count=count)
+                                 for i, count in enumerate((1, 1, 4, 1, 1))])
+        self.dbc.upsert_relations([dict(author_url="a{}".format(i), article_url="u1") for i in range(5)])
+        self.dbc.upsert_author_refreshes([
+            dict(author_url="a1", last_scraped_at=now - timedelta(days=30)),
+            dict(author_url="a2", last_scraped_at=now - timedelta(days=10), etag='"v2"'),
+            dict(author_url="a3", last_scraped_at=now - timedelta(days=20)),
+            dict(author_url="a4", last_scraped_at=now - timedelta(days=1))])
+        # a0 was never refreshed, a2 is 3 articles off, a4 was scraped recently
+        self.assertEqual([author["url"] for author in self.dbc.get_stale_authors(10)], ["a0", "a2", "a1", "a3"])
+        self.assertEqual(self.dbc.get_stale_authors(2)[1], {"url": "a2", "etag": '"v2"', "last_modified": None})
+
+    def test_urls_are_split_across_shards(self):
+        urls = ["https://blog.griddynamics.com/author/{}".format(i) for i in range(50)]
+        shards = [[url for url in urls if in_shard(url, index, 3)] for index in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(urls))
+
+    def test_search_ranks_and_filters_articles(self):
+        self.dbc.upsert_articles([
+            dict(url="u1", title="Semantic search", pub_date=date(2020, 3, 1), text="vectors", tags="Search"),
+            dict(url="u2", title="Autocomplete", pub_date=date(2020, 1, 1), text="semantic search boxes",
+                 tags="Search:::E-commerce"),
+            dict(url="u3", title="Kubernetes", pub_date=date(2020, 2, 1), text="clusters", tags="Cloud")])
+        self.assertEqual([row.url for row in self.dbc.search("semantic search")], ["u1", "u2"])
+        self.assertEqual([row.url for row in self.dbc.search("search", tag="E-commerce")], ["u2"])
+        self.assertEqual([row.url for row in self.dbc.search("search", since=date(2020, 2, 1))], ["u1"])
+        self.assertEqual(self.dbc.search("kubernetes")[0].snippet, "[Kubernetes]")
+        self.dbc.upsert_articles([dict(url="u3", title="Containers", pub_date=date(2020, 2, 1), text="clusters")])
+        self.assertEqual(self.dbc.search("kubernetes"), [])
+        with self.assertRaises(ValueError):
+            self.dbc.search('"unterminated')
+
+    def test_bodies_are_compressed_and_loaded_lazily(self):
+        body = "Semantic search helps customers find products.\n" * 200
+        self.dbc.upsert_articles([dict(url="u1", title="T1", pub_date=date(2020, 3, 1), text=body[:160])])
+        self.dbc.upsert_bodies([dict(article_url="u1", body=body)], codec="zlib")
+        with self.dbc.session_scope() as session:
+            article = session.query(Article).one()
+            self.assertNotIn("body", article.__dict__)
+            self.assertNotIn("data", article.body.__dict__)
+            self.assertEqual(article.body.text, body)
+        stats = self.dbc.get_body_stats()["zlib"]
+        self.assertEqual((stats["bodies"], stats["raw_bytes"]), (1, len(body)))
+        self.assertGreater(stats["compression_ratio"], 10)
+
+    def test_changed_fingerprint_is_a_revision(self):
+        self.dbc.upsert_fingerprints([dict(url="u1", fingerprint="a"), dict(url="u2", fingerprint="b")])
+        self.dbc.upsert_fingerprints([dict(url="u1", fingerprint="a2", etag='"2"'), dict(url="u2", fingerprint="b")])
+        with self.dbc.session_scope() as session:
+            rows = {row.url: row for row in session.query(ContentFingerprint)}
+        self.assertEqual((rows["u1"].revisions, rows["u2"].revisions), (1, 0))
+        self.assertGreater(rows["u1"].revised_at, rows["u1"].first_seen_at)
+        self.assertEqual(rows["u2"].revised_at, rows["u2"].first_seen_at)
+        self.assertEqual(self.dbc.get_fingerprints()["u1"], {"fingerprint": "a2", "etag": '"2"', "last_modified": None})
+
+    def test_table_getters_return_queries(self):
+        self.dbc.upsert_authors([dict(url="a1", name="Author 1", articles_count=1),
+                                 dict(url="a2", name="Author 2", articles_count=2)])
+        self.assertEqual([author.url for author in self.dbc.get_authors().filter(Author.articles_count > 1)], ["a2"])
+        self.assertEqual(self.dbc.engine.pool.checkedout(), 0)
+
+    def test_sessions_are_released(self):
+        with self.dbc.session_scope():
+            self.assertEqual(self.dbc.connection_stats()["open_sessions"], 1)
+        self.assertEqual(self.dbc.get_authors().all(), [])
+        stats = self.dbc.connection_stats()
+        self.assertEqual(stats["open_sessions"], 0)
+        self.assertEqual(stats["checked_out"], 0)
+
+    def test_sqlite_pragmas(self):
+        with self.dbc.engine.connect() as connection:
+            self.assertEqual(connection.execute("PRAGMA journal_mode").scalar(), "wal")
+            self.assertEqual(connection.execute("PRAGMA synchronous").scalar(), 1)
+
+
+class ArticleSpiderTests(unittest.TestCase):
+
+    def test_streamed_author_requests_are_deduplicated(self):
+        spider = ArticleSpider()
+        spider.stream_authors = True
+        spider.known_authors = {"https://blog/author/known/"}
+        requests = spider._gen_author_requests(["https://blog/author/known/", "https://blog/author/new/",
+                                                "https://blog/author/new/"])
+        self.assertEqual([request.url for request in requests], ["https://blog/author/new/"])
+        self.assertEqual(spider._gen_author_requests(["https://blog/author/new/"]), [])
+
+    def test_unchanged_article_pages_are_skipped(self):
+        spider = ArticleSpider()
+        spider.skip_unchanged = True
+        response = load_response(os.path.join(FIXTURES, "article.html"))
+        items = list(spider.parse_article_child_page(response))
+        self.assertEqual([type(item).__name__ for item in items],
+                         ["ArticleItem", "ArticleAuthorItem", "ContentFingerprintItem"])
+        self.assertEqual(list(spider.parse_article_child_page(response)), [])
+        reformatted = response.replace(body=response.body.replace(b"\n", b"\n  "))
+        self.assertEqual(list(spider.parse_article_child_page(reformatted)), [])
+        revised = response.replace(body=response.body.replace(b"Semantic search", b"Vector search"))
+        self.assertEqual(len(list(spider.parse_article_child_page(revised))), 3)
+        request = spider._article_request(response.url)
+        self.assertEqual(request.headers, {})
+        spider.fingerprints[response.url]["etag"] = '"v2"'
+        self.assertEqual(spider._article_request(response.url).headers[b"If-None-Match"], b'"v2"')
+
+    def test_author_refresh_is_conditional(self):
+        requests = list(author_refresh_requests([{"url": "https://blog/author/a/", "etag": '"v1"',
+                                                  "last_modified": None}], ArticleSpider().parse_author_page))
+        self.assertEqual(requests[0].headers[b"If-None-Match"], b'"v1"')
+        response = HtmlResponse("https://blog/author/a/", status=304, request=requests[0], headers={'ETag': '"v1"'})
+        self.assertEqual([dict(item) for item in requests[0].callback(response)],
+                         [{"author_url": "https://blog/author/a/", "etag": '"v1"', "last_modified": None}])
+
+    def test_fast_parser_matches_item_loaders(self):
+        response = load_response(os.path.join(FIXTURES, "article.html"))
+        expected = [dict(item) for item in ArticleSpider._load_article_items(response)]
+        self.assertEqual([dict(item) for item in extract_article(response)], expected)
+        self.assertEqual(len(expected[0]["text"]), 160)
+        body = extract_body(response)
+        self.assertTrue(body.startswith("Introduction\nSemantic search helps customers"))
+        self.assertGreater(len(body), 1000)
+        self.assertEqual(expected[1]["authors"], ["https://blog.griddynamics.com/author/eugene-steinberg/",
+                                                  "https://blog.griddynamics.com/author/ilya-katsov/"])
+
+    def test_synthetic_blog_pages_are_parsed(self):
+        blog = SyntheticBlog(articles=10, sections=2, authors=3, page_size=3)
+        response = HtmlResponse("http://local/article-4/", body=blog.article_page(4).encode(), encoding='utf-8')
+        article, article_authors = extract_article(response, "http://local")
+        self.assertEqual(article["title"], "Synthetic article 4")
+        self.assertEqual(article["pub_date"], blog.pub_date(4))
+        self.assertEqual(article_authors["authors"], ["http://local/author/author-{}/".format(author)
+                                                      for author in blog.article_authors(4)])
+
+    SECTION_PAGE = """<html><head><link rel="next" href="/section/page/2"></head><body>
+        <a class="card cardtocheck" href="/new/"><span class="name">Mar 30, 2020 •</span></a>
+        <a class="card cardtocheck" href="/same-day/"><span class="name">Mar 16, 2020 •</span></a>
+        <a class="card cardtocheck" href="/seen/"><span class="name">Mar 16, 2020 •</span></a>
+        <a class="card cardtocheck" href="/old/"><span class="name">Mar 13, 2020 •</span></a>
+        </body></html>"""
+
+    def _section_response(self, status=200, meta=None):
+        request = Request("https://blog/section", meta=dict({'section': "https://blog/section"}, **(meta or {})))
+        return HtmlResponse("https://blog/section", status=status, body=self.SECTION_PAGE.encode(),
+                            encoding='utf-8', request=request, headers={'ETag': '"v2"'})
+
+    def test_incremental_crawl_skips_articles_older_than_watermark(self):
+        spider = ArticleSpider()
+        spider.root_url = "https://blog"
+        spider.section_states = {"https://blog/section": {"watermark": date(2020, 3, 16),
+                                                          "watermark_urls": ["https://blog/seen/"]}}
+        results = list(spider.parse_article_multi_record_page(self._section_response()))
+        self.assertEqual([result.url for result in results],
+                         ["https://blog/new/", "https://blog/same-day/", "https://blog/section/page/2/"])
+        self.assertEqual(spider.completed_section_states(), [])
+        state = spider.sections["https://blog/section"]["state"]
+        self.assertEqual(state['watermark'], date(2020, 3, 30))
+        self.assertEqual(state['watermark_urls'], ["https://blog/new/"])
+        self.assertEqual(state['etag'], '"v2"')
+
+    def test_batched_cards_match_per_card_parsing(self):
+        blog = SyntheticBlog(articles=40, sections=2, authors=3, page_size=10)
+        pages = [self._section_response(), HtmlResponse("http://local/section-1/", body=blog.section_page(1).encode(),
+                                                         encoding='utf-8')]
+        watermark = (date(2020, 3, 27), frozenset({"https://blog/article-9/"}))
+        for page in pages:
+            generated = []
+            for fast_parser in (False, True):
+                spider = ArticleSpider()
+                spider.root_url, spider.fast_parser = "https://blog", fast_parser
+                cards_seen = []
+                requests = spider._gen_requests(page, watermark, cards_seen)
+                generated.append(([request.url for request in requests], cards_seen))
+            self.assertEqual(generated[0], generated[1])
+        self.assertEqual(generated[1][0],
+                         ["https://blog/article-{}/".format(article) for article in (1, 3, 5, 7, 11, 1)])
+
+    def test_pagination_stops_at_page_older_than_watermark(self):
+        spider = ArticleSpider()
+        spider.root_url = "https://blog"
+        spider.last_date = date(2020, 3, 30)
+        spider.last_date_urls = {"https://blog/new/"}
+        results = list(spider.parse_article_multi_record_page(self._section_response(meta={'page': 2})))
+        self.assertEqual(results, [])
+
+    def test_unchanged_section_is_skipped(self):
+        self.assertEqual(list(ArticleSpider().parse_article_multi_record_page(self._section_response(304))), [])
+
+
+class UrlTests(unittest.TestCase):
+
+    def test_urls_are_canonicalized(self):
+        expected = "https://blog.griddynamics.com/author/ilya-katsov/"
+        for url in ("/author/ilya-katsov", "author/ilya-katsov/",
+                    "HTTPS://Blog.GridDynamics.com:443/author/ilya-katsov",
+                    "https://blog.griddynamics.com/author/ilya-katsov/?utm_source=feed#posts"):
+            self.assertEqual(canonicalize_url(url), expected)
+        self.assertEqual(canonicalize_url("/article-1?b=2&a=1&fbclid=x", "http://local:8080"),
+                         "http://local:8080/article-1/?a=1&b=2")
+        self.assertEqual(canonicalize_url("/images/cover.png"), "https://blog.griddynamics.com/images/cover.png")
+
+    def test_urls_seen_by_earlier_crawls_are_filtered(self):
+        dupefilter = SeenUrlDupeFilter()
+        dupefilter.seen_urls = frozenset({"https://blog/article-1/"})
+        self.assertTrue(dupefilter.request_seen(Request("https://blog/article-1", meta={'dedupe_across_runs': True})))
+        self.assertFalse(dupefilter.request_seen(Request("https://blog/article-1")))
+        self.assertTrue(dupefilter.request_seen(Request("https://blog/article-1/#comments")))
+        self.assertFalse(dupefilter.request_seen(Request("https://blog/article-2", meta={'dedupe_across_runs': True})))
+
+    def test_seen_articles_are_revalidated_when_skipping_unchanged(self):
+        dupefilter = SeenUrlDupeFilter()
+        dupefilter.seen_urls = frozenset({"https://blog/article-1/"})
+        spider = ArticleSpider()
+        spider.fingerprints = {"https://blog/article-1/": {"fingerprint": "f1", "etag": '"v1"', "last_modified": None}}
+        self.assertTrue(dupefilter.request_seen(spider._article_request("https://blog/article-1/")))
+        spider.skip_unchanged = True
+        request = spider._article_request("https://blog/article-1/")
+        self.assertFalse(dupefilter.request_seen(request))
+        self.assertEqual(request.headers[b"If-None-Match"], b'"v1"')
+
+
+class CrawlSettingsTests(unittest.TestCase):
+
+    def test_profile_overrides_project_settings(self):
+        settings = get_crawl_settings('offline-replay')
+        self.assertTrue(settings.getbool('HTTPCACHE_ENABLED'))
+        self.assertTrue(settings.getbool('HTTPCACHE_IGNORE_MISSING'))
+        self.assertEqual(settings.get('CRAWL_PROFILE'), 'offline-replay')
+
+    def test_scrape_entry_point_delegates_to_cli_crawl(self):
+        with mock.patch("scrape.start") as start:
+            scrape_main(["--profile", "fast", "--shards", "2"])
+        start.assert_called_once_with(stream_authors=None, profile="fast", shards=2)
+
+    def test_unknown_profile(self):
+        self.assertRaises(ValueError, get_crawl_settings, 'reckless')
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_histogram_exposition(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('write_seconds', 'Write time', buckets=(0.1, 1))
+        histogram.observe(0.05, table="articles")
+        histogram.observe(0.5, table="articles")
+        registry.counter('items_total', 'Items').inc(type="ArticleItem")
+        exposition = registry.exposition()
+        self.assertIn('write_seconds_bucket{table="articles",le="0.1"} 1', exposition)
+        self.assertIn('write_seconds_bucket{table="articles",le="+Inf"} 2', exposition)
+        self.assertIn('write_seconds_count{table="articles"} 2', exposition)
+        self.assertIn('items_total{type="ArticleItem"} 1', exposition)
+        self.assertEqual(histogram.totals(), {(("table", "articles"),): (2, 0.55)})
+
+
+class RelationGraphTests(TemporaryDatabaseTestCase):
+
+    def test_graph_answers_relation_queries_after_reload(self):
+        self.dbc.upsert_articles([dict(url="u{}".format(i), title="T", pub_date=date(2020, 3, 1), text="text",
+                                       tags=tags) for i, tags in enumerate(("t1:::t2", "t2", "t3"))])
+        self.dbc.upsert_relations([dict(author_url=author_url, article_url=article_url) for author_url, article_url
+                                   in (("a1", "u0"), ("a2", "u0"), ("a1", "u1"), ("a2", "u1"), ("a3", "u1"),
+                                       ("a3", "u2"), ("a4", "u9"))])
+        built = RelationGraph.build(self.dbc, chunk_size=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            built.save(path)
+            loaded = RelationGraph.load(path)
+            for relation_graph in (built, loaded):
+                self.assertEqual(relation_graph.articles_of("a1"), ["u0", "u1"])
+                self.assertEqual(relation_graph.authors_of("u1"), ["a1", "a2", "a3"])
+                self.assertEqual(relation_graph.coauthor_counts("a1"), {"a2": 2, "a3": 1})
+                self.assertEqual(relation_graph.tag_histogram("a1"), {"t2": 2, "t1": 1})
+                self.assertEqual(relation_graph.tag_histogram("a4"), {})
+                self.assertEqual(relation_graph.relation_counts(), {"a1": 2, "a2": 2, "a3": 2, "a4": 1})
+                self.assertRaises(KeyError, relation_graph.articles_of, "a5")
+            del loaded, relation_graph
+
+
+class ExportTests(TemporaryDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output.cleanup)
+        self.dbc.upsert_articles([dict(url="u1", title="T1", pub_date=date(2020, 2, 1), text="text"),
+                                  dict(url="u2", title="T2", pub_date=date(2020, 3, 1), text="text")])
+        self.dbc.upsert_relations([dict(author_url="a1", article_url="u1")])
+
+    def _read_jsonl(self, *path):
+        with open(os.path.join(self.output.name, *path)) as file:
+            return [json.loads(line) for line in file]
+
+    def test_incremental_jsonl_export(self):
+        with mock.patch.object(export, "WATERMARK_LAG", timedelta(0)):
+            self.assertEqual(export.export(self.dbc, self.output.name, chunk_size=1),
+                             {"articles": 2, "authors": 0, "author_article": 1})
+            self.dbc.upsert_articles([dict(url="u2", title="New T2", pub_date=date(2020, 3, 1), text="text")])
+            self.assertEqual(export.export(self.dbc, self.output.name, incremental=True),
+                             {"articles": 1, "authors": 0, "author_article": 0})
+        parts = sorted(os.listdir(os.path.join(self.output.name, "articles", "year=2020", "month=03")))
+        self.assertEqual(len(parts), 2)
+        self.assertEqual([row["title"] for row in self._read_jsonl("articles", "year=2020", "month=03", parts[1])],
+                         ["New T2"])
+        self.assertEqual(self._read_jsonl("articles", "year=2020", "month=02", os.listdir(
+            os.path.join(self.output.name, "articles", "year=2020", "month=02"))[0])[0]["pub_date"], "2020-02-01")
+
+    @unittest.skipIf(export.pyarrow is None, "pyarrow is not installed")
+    def test_parquet_export(self):
+        export.export(self.dbc, self.output.name, "parquet")
+        table = export.pyarrow.parquet.read_table(os.path.join(self.output.name, "articles"))
+        self.assertEqual(sorted(table.column("url").to_pylist()), ["u1", "u2"])
+
 
 if __name__ == '__main__':
     unittest.main()
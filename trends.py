@@ -0,0 +1,76 @@
+"""Time-windowed analytics over the weekly and monthly numbers of articles per tag and per author
+
+The numbers are kept in the tag_trend and author_trend bucket tables, updated in the transaction that writes the
+articles and relations they count, so the analytics read bucket rows only and never scan the articles.
+"""
+from collections import Counter, deque
+from datetime import timedelta
+
+from models import DatabaseController, bucket_start
+
+
+def shift_bucket(bucket, period, buckets):
+    """:returns the bucket the given number of buckets after bucket, before it for a negative number"""
+
+    if period == "week":
+        return bucket + timedelta(weeks=buckets)
+    months = bucket.year * 12 + bucket.month - 1 + buckets
+    return bucket.replace(year=months // 12, month=months % 12 + 1)
+
+
+def rolling_counts(dbc: DatabaseController, period="week", window=4, tag=None, author_url=None, since=None,
+                   until=None):
+    """:returns (bucket, articles in the bucket, articles in the window of buckets ending with it), oldest first
+
+    Every bucket between since and until is returned, empty ones with zero articles.
+    :param since: date in the first bucket, the first bucket with articles of the tag or the author by default, so
+        nothing is returned for a tag or an author without articles unless since is given
+    :param until: date in the last bucket, the newest bucket with tagged articles by default, nothing is returned
+        when there are no tagged articles at all
+    """
+
+    if window < 1:
+        raise ValueError("Window has to span at least one bucket")
+    until = bucket_start(until, period) if until is not None else dbc.get_last_trend_bucket(period)
+    if until is None:
+        return []
+    first = None if since is None else shift_bucket(bucket_start(since, period), period, 1 - window)
+    counts = dict(dbc.get_trend(period, tag, author_url, first, until))
+    if since is not None:
+        since = bucket_start(since, period)
+    elif counts:
+        since = min(counts)
+    else:
+        return []
+    bucket, windowed, rolling = shift_bucket(since, period, 1 - window), deque(), []
+    while bucket <= until:
+        windowed.append(counts.get(bucket, 0))
+        if len(windowed) > window:
+            windowed.popleft()
+        if bucket >= since:
+            rolling.append((bucket, windowed[-1], sum(windowed)))
+        bucket = shift_bucket(bucket, period, 1)
+    return rolling
+
+
+def fastest_growing_tags(dbc: DatabaseController, weeks=4, limit=10, until=None):
+    """:returns (tag, articles in the last weeks, articles in the weeks before, growth) of the fastest growing tags
+
+    Growth is the difference of the numbers of articles in the last weeks and in the same number of weeks before
+    them, tags that did not grow are left out.
+    :param until: date in the last week, the newest week with tagged articles by default
+    """
+
+    if weeks < 1:
+        raise ValueError("Window has to span at least one week")
+    until = bucket_start(until, "week") if until is not None else dbc.get_last_trend_bucket("week")
+    if until is None:
+        return []
+    split = shift_bucket(until, "week", 1 - weeks)
+    recent, previous = Counter(), Counter()
+    for tag, bucket, count in dbc.get_tag_trends("week", shift_bucket(split, "week", -weeks), until):
+        (recent if bucket >= split else previous)[tag] += count
+    growing = [(tag, recent[tag], previous[tag], recent[tag] - previous[tag])
+               for tag in recent if recent[tag] > previous[tag]]
+    growing.sort(key=lambda row: (-row[3], -row[1], row[0]))
+    return growing[:limit]